@@ -4,12 +4,12 @@ from aws_cdk import (
     aws_apigateway as apigw,
     aws_dynamodb as ddb,
     aws_sqs as sqs,
-    aws_lambda_event_sources as events,
     aws_cognito as cognito,
     aws_secretsmanager as secretsmanager,
+    aws_events as eventbridge,
+    aws_events_targets as targets,
 )
 
-from os import path
 from typing import Callable
 
 
@@ -18,13 +18,27 @@ class AsetuapiStack(core.Stack):
         self,
         scope: core.Construct,
         id: str,
-        create_dependency_layer: Callable[[], None],
+        create_dependency_layer: Callable[[], str],
         **kwargs
     ) -> None:
         super().__init__(scope, id, **kwargs)
 
         # create dependency layer zip for lambda function
-        create_dependency_layer()
+        dependency_layer_zip = create_dependency_layer()
+
+        # queue receiver batching can be tuned with cdk context values
+        queue_batch_size = self.node.try_get_context("queue_batch_size") or 10
+        queue_batching_window = (
+            self.node.try_get_context("queue_batching_window_seconds") or 5
+        )
+        queue_max_concurrency = self.node.try_get_context("queue_max_concurrency") or 10
+        resolve_pending_minutes = (
+            self.node.try_get_context("resolve_pending_minutes") or 5
+        )
+        # optional redis compatible cache shared by every instance, it must
+        # be reachable from the functions, e.g. through a VPC
+        cache_url = self.node.try_get_context("cache_url")
+        cache_environment = {"CACHE_URL": cache_url} if cache_url else {}
 
         api_secret = secretsmanager.Secret(
             self,
@@ -61,6 +75,19 @@ class AsetuapiStack(core.Stack):
         )
         self._user_status_table = user_status_table
 
+        # unexpired statuses are queried by request status ordered by expiry
+        # items are stored in the compact form of lambda/item_codec.py, the
+        # request status code is "s", the colour "c" and the message "m"
+        # expdate is a number so that ttl deletes expired items
+        status_index_name = "StatusCodeExpiryIndex"
+        user_status_table.add_global_secondary_index(
+            index_name=status_index_name,
+            partition_key={"name": "s", "type": ddb.AttributeType.NUMBER},
+            sort_key={"name": "expdate", "type": ddb.AttributeType.NUMBER},
+            projection_type=ddb.ProjectionType.INCLUDE,
+            non_key_attributes=["m", "c"],
+        )
+
         requests_table = ddb.Table(
             self,
             "RequestsTable",
@@ -68,11 +95,27 @@ class AsetuapiStack(core.Stack):
             time_to_live_attribute="expdate",
         )
 
+        # tokens are minted ahead of demand and leased from this table
+        token_pool_table = ddb.Table(
+            self,
+            "TokenPoolTable",
+            partition_key={"name": "pool", "type": ddb.AttributeType.STRING},
+            sort_key={"name": "token_id", "type": ddb.AttributeType.STRING},
+            time_to_live_attribute="expdate",
+        )
+
+        # rate limits of upstream endpoints are shared through this table
+        upstream_state_table = ddb.Table(
+            self,
+            "UpstreamStateTable",
+            partition_key={"name": "name", "type": ddb.AttributeType.STRING},
+        )
+
         # Create layer for lambda run time dependencies
         dependency_layer = _lambda.LayerVersion(
             self,
             "PythonDependencies",
-            code=_lambda.Code.from_asset(path.join("lambda", "dependency-layer.zip")),
+            code=_lambda.Code.from_asset(dependency_layer_zip),
             compatible_runtimes=[_lambda.Runtime.PYTHON_3_7],
             description="The layer contains requests and pyjwt dependencies",
         )
@@ -90,14 +133,45 @@ class AsetuapiStack(core.Stack):
                 "USER_STATUS_TABLE": user_status_table.table_name,
                 "REQUESTS_TABLE": requests_table.table_name,
                 "API_SECRET_ARN": api_secret.secret_full_arn,
+                "TOKEN_POOL_TABLE": token_pool_table.table_name,
+                "UPSTREAM_STATE_TABLE": upstream_state_table.table_name,
+                **cache_environment,
             },
         )
 
         # give lambda access permissions to ddb tables and secrets
         user_status_table.grant_read_write_data(single_request)
         requests_table.grant_read_write_data(single_request)
+        token_pool_table.grant_read_write_data(single_request)
+        upstream_state_table.grant_read_write_data(single_request)
         api_secret.grant_read(single_request)
 
+        # api gateway gives up after 29 seconds, the handler returns what it
+        # resolved by then with the other numbers marked pending
+        batch_request = _lambda.Function(
+            self,
+            "BatchRequestHandler",
+            runtime=_lambda.Runtime.PYTHON_3_7,
+            code=_lambda.Code.asset("lambda"),
+            handler="batch_request.handler",
+            timeout=core.Duration.seconds(28),
+            layers=[dependency_layer],
+            environment={
+                "USER_STATUS_TABLE": user_status_table.table_name,
+                "REQUESTS_TABLE": requests_table.table_name,
+                "API_SECRET_ARN": api_secret.secret_full_arn,
+                "TOKEN_POOL_TABLE": token_pool_table.table_name,
+                "UPSTREAM_STATE_TABLE": upstream_state_table.table_name,
+                **cache_environment,
+            },
+        )
+
+        user_status_table.grant_read_write_data(batch_request)
+        requests_table.grant_read_write_data(batch_request)
+        token_pool_table.grant_read_write_data(batch_request)
+        upstream_state_table.grant_read_write_data(batch_request)
+        api_secret.grant_read(batch_request)
+
         bulk_request = _lambda.Function(
             self,
             "BulkRequestHandler",
@@ -124,23 +198,97 @@ class AsetuapiStack(core.Stack):
             environment={
                 "USER_STATUS_TABLE": user_status_table.table_name,
                 "REQUESTS_TABLE": requests_table.table_name,
-                "QUEUE_URL": bulk_request_queue.queue_url,
                 "API_SECRET_ARN": api_secret.secret_full_arn,
+                "TOKEN_POOL_TABLE": token_pool_table.table_name,
+                "UPSTREAM_STATE_TABLE": upstream_state_table.table_name,
+                **cache_environment,
             },
         )
 
-        # lambda gets triggered by sqs queue and writes to both tables
-        queue_receiver.add_event_source(
-            events.SqsEventSource(bulk_request_queue, batch_size=1)
+        # lambda gets triggered by batches of messages and writes to both tables,
+        # only the messages it reports as failed are retried
+        queue_mapping = queue_receiver.add_event_source_mapping(
+            "BulkRequestQueueMapping",
+            event_source_arn=bulk_request_queue.queue_arn,
+            batch_size=queue_batch_size,
+            max_batching_window=core.Duration.seconds(queue_batching_window),
+            report_batch_item_failures=True,
+        )
+        # cdk v1 has no maximum concurrency option, set it on the resource
+        queue_mapping.node.default_child.add_property_override(
+            "ScalingConfig.MaximumConcurrency", queue_max_concurrency
         )
 
         # give queue receiver access to tables, queue and secrets
         bulk_request_queue.grant_consume_messages(queue_receiver)
         user_status_table.grant_read_write_data(queue_receiver)
         requests_table.grant_read_write_data(queue_receiver)
+        token_pool_table.grant_read_write_data(queue_receiver)
+        upstream_state_table.grant_read_write_data(queue_receiver)
 
         api_secret.grant_read(queue_receiver)
 
+        mint_tokens = _lambda.Function(
+            self,
+            "MintTokensHandler",
+            runtime=_lambda.Runtime.PYTHON_3_7,
+            code=_lambda.Code.asset("lambda"),
+            handler="mint_tokens.handler",
+            timeout=core.Duration.seconds(60),
+            layers=[dependency_layer],
+            environment={
+                "USER_STATUS_TABLE": user_status_table.table_name,
+                "REQUESTS_TABLE": requests_table.table_name,
+                "API_SECRET_ARN": api_secret.secret_full_arn,
+                "TOKEN_POOL_TABLE": token_pool_table.table_name,
+                "UPSTREAM_STATE_TABLE": upstream_state_table.table_name,
+            },
+        )
+
+        # keep the token pool topped up ahead of demand
+        eventbridge.Rule(
+            self,
+            "MintTokensSchedule",
+            schedule=eventbridge.Schedule.rate(core.Duration.minutes(1)),
+            targets=[targets.LambdaFunction(mint_tokens)],
+        )
+
+        token_pool_table.grant_read_write_data(mint_tokens)
+        upstream_state_table.grant_read_write_data(mint_tokens)
+        api_secret.grant_read(mint_tokens)
+
+        resolve_pending = _lambda.Function(
+            self,
+            "ResolvePendingHandler",
+            runtime=_lambda.Runtime.PYTHON_3_7,
+            code=_lambda.Code.asset("lambda"),
+            handler="resolve_pending.handler",
+            timeout=core.Duration.minutes(5),
+            layers=[dependency_layer],
+            environment={
+                "USER_STATUS_TABLE": user_status_table.table_name,
+                "REQUESTS_TABLE": requests_table.table_name,
+                "API_SECRET_ARN": api_secret.secret_full_arn,
+                "UPSTREAM_STATE_TABLE": upstream_state_table.table_name,
+                **cache_environment,
+            },
+        )
+
+        # resolve pending requests in the background
+        eventbridge.Rule(
+            self,
+            "ResolvePendingSchedule",
+            schedule=eventbridge.Schedule.rate(
+                core.Duration.minutes(resolve_pending_minutes)
+            ),
+            targets=[targets.LambdaFunction(resolve_pending)],
+        )
+
+        user_status_table.grant_read_write_data(resolve_pending)
+        requests_table.grant_read_write_data(resolve_pending)
+        upstream_state_table.grant_read_write_data(resolve_pending)
+        api_secret.grant_read(resolve_pending)
+
         scan_table = _lambda.Function(
             self,
             "ScanTableHandler",
@@ -150,6 +298,7 @@ class AsetuapiStack(core.Stack):
             timeout=core.Duration.seconds(30),
             environment={
                 "USER_STATUS_TABLE": user_status_table.table_name,
+                "STATUS_INDEX": status_index_name,
             },
         )
 
@@ -185,6 +334,16 @@ class AsetuapiStack(core.Stack):
             authorization_type=apigw.AuthorizationType.COGNITO,
         )
 
+        batch_request_integration = apigw.LambdaIntegration(batch_request, proxy=True)
+        batch_request_resource = single_request_resource.add_resource("batch")
+        batch_method = batch_request_resource.add_method(
+            "POST",
+            batch_request_integration,
+            api_key_required=False,
+            authorizer=auth,
+            authorization_type=apigw.AuthorizationType.COGNITO,
+        )
+
         bulk_request_integration = apigw.LambdaIntegration(bulk_request, proxy=True)
         bulk_request_resource = api.root.add_resource("bulk_status")
         bulk_method = bulk_request_resource.add_method(
@@ -207,7 +366,7 @@ class AsetuapiStack(core.Stack):
 
         # Override authorizer to use COGNITO to authorize apis
         # Solution from: https://github.com/aws/aws-cdk/issues/9023#issuecomment-658309644
-        methods = [single_method, bulk_method, scan_method]
+        methods = [single_method, batch_method, bulk_method, scan_method]
         for method in methods:
             method.node.find_child("Resource").add_property_override(
                 "AuthorizationType", "COGNITO_USER_POOLS"
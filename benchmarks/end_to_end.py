@@ -0,0 +1,513 @@
+"""
+End to end benchmark of the single_request, bulk_request, queue_receiver
+and scan_table handlers. The handlers run in process against moto backed
+DynamoDB, SQS and Secrets Manager and a local stub of the Aarogya Setu
+endpoints.
+
+Run from the repository root after installing benchmarks/requirements.txt:
+
+    python benchmarks/end_to_end.py             # compare with the baseline
+    python benchmarks/end_to_end.py --update    # store a new baseline
+
+Exits with status 1 if a phase got slower than its baseline by more than
+the tolerance.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import contextlib
+
+from stub_server import APPROVED_STATUS, JWT_SECRET, StubConfig, start_stub_server
+
+# global variables
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda")
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "end_to_end_baseline.json")
+TOLERANCE = 0.5  # allowed slowdown as a fraction of the baseline
+SLACK_MS = 5  # allowed slowdown in milliseconds, absorbs noise of fast phases
+COMPARED_STATS = ("p50_ms", "p95_ms")
+QUEUE_BATCH_SIZE = 10
+SCAN_TABLE_ITEMS = 1000
+SCAN_PAGE_SIZE = "100"
+LAMBDA_TIMEOUT_MILLIS = 10000
+TABLES = {
+    "USER_STATUS_TABLE": "benchmark-user-status",
+    "REQUESTS_TABLE": "benchmark-requests",
+    "TOKEN_POOL_TABLE": "benchmark-token-pool",
+}
+STATUS_INDEX = "StatusCodeExpiryIndex"
+WHITE = "#FFFFFF"
+
+
+class FakeContext:
+    """Lambda context that gives the remaining time of an invocation"""
+
+    def __init__(self, timeout_millis=LAMBDA_TIMEOUT_MILLIS):
+        self.deadline = time.monotonic() + timeout_millis / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def percentile(values, fraction):
+    """
+    Nearest rank percentile of a list of values
+
+    Parameters
+    ----------
+    values: list
+        Measured values
+    fraction: float
+        Percentile as a fraction between 0 and 1
+    """
+
+    ordered = sorted(values)
+    rank = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarise(latencies, items, unexpected):
+    """
+    Summarise the calls of a phase
+
+    Parameters
+    ----------
+    latencies: list
+        Seconds each call took
+    items: int
+        Number of mobile numbers or items handled in the phase
+    unexpected: int
+        Number of calls whose response did not match the phase
+    """
+
+    return {
+        "calls": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "items_per_second": round(items / sum(latencies), 1),
+        "unexpected": unexpected,
+    }
+
+
+def timed_calls(calls):
+    """
+    Run calls one after the other and time them. Returns the summary of
+    every phase keyed by phase name.
+
+    Parameters
+    ----------
+    calls: list
+        Tuples of the phase, a function, its arguments, the number of items
+        it handles and a check that the response matches the phase
+    """
+
+    latencies = {}
+    items = {}
+    unexpected = {}
+
+    # keep the embedded metric lines printed by the handlers out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for phase, function, args, count, expected in calls:
+            start = time.perf_counter()
+            response = function(*args)
+            latencies.setdefault(phase, []).append(time.perf_counter() - start)
+            items[phase] = items.get(phase, 0) + count
+            unexpected[phase] = unexpected.get(phase, 0) + (not expected(response))
+
+    return {
+        phase: summarise(latencies[phase], items[phase], unexpected[phase])
+        for phase in latencies
+    }
+
+
+def is_ok(response):
+    return response["statusCode"] == 200
+
+
+def is_pending(response):
+    return is_ok(response) and json.loads(response["body"])["colour"] == WHITE
+
+
+def is_approved(response):
+    colour = APPROVED_STATUS["color_code"]
+    return is_ok(response) and json.loads(response["body"])["colour"] == colour
+
+
+def has_no_failures(response):
+    return not response["batchItemFailures"]
+
+
+def configure_environment(base_url, rate_limit):
+    """
+    Point the handlers at the stub and the moto resources. Must run before
+    the handlers are imported because they read the environment on import.
+
+    Parameters
+    ----------
+    base_url: str
+        Base url of the Aarogya Setu stub
+    rate_limit: float
+        Calls per second allowed to every stub endpoint
+    """
+
+    os.environ.update(
+        {
+            "AWS_DEFAULT_REGION": "ap-south-1",
+            "AWS_ACCESS_KEY_ID": "benchmark",
+            "AWS_SECRET_ACCESS_KEY": "benchmark",
+            "API_BASE_URL": base_url,
+            "API_SECRET_ARN": "benchmark-api-secret",
+            "STATUS_INDEX": STATUS_INDEX,
+            "TOKEN_RATE_PER_SECOND": str(rate_limit),
+            "USER_STATUS_RATE_PER_SECOND": str(rate_limit),
+            "USER_STATUS_BY_REQUEST_RATE_PER_SECOND": str(rate_limit),
+        }
+    )
+    os.environ.update(TABLES)
+    os.environ.pop("UPSTREAM_STATE_TABLE", None)
+    sys.path.insert(0, LAMBDA_DIR)
+
+
+def create_resources():
+    """Create the tables, queue and secret the handlers use in moto"""
+
+    import boto3
+
+    dynamodb = boto3.client("dynamodb")
+    string_key = {"AttributeType": "S"}
+
+    dynamodb.create_table(
+        TableName=TABLES["USER_STATUS_TABLE"],
+        KeySchema=[{"AttributeName": "mobile_number", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            dict(AttributeName="mobile_number", **string_key),
+            dict(AttributeName="s", AttributeType="N"),
+            dict(AttributeName="expdate", AttributeType="N"),
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": STATUS_INDEX,
+                "KeySchema": [
+                    {"AttributeName": "s", "KeyType": "HASH"},
+                    {"AttributeName": "expdate", "KeyType": "RANGE"},
+                ],
+                "Projection": {
+                    "ProjectionType": "INCLUDE",
+                    "NonKeyAttributes": ["m", "c"],
+                },
+            }
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb.create_table(
+        TableName=TABLES["REQUESTS_TABLE"],
+        KeySchema=[{"AttributeName": "mobile_number", "KeyType": "HASH"}],
+        AttributeDefinitions=[dict(AttributeName="mobile_number", **string_key)],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    dynamodb.create_table(
+        TableName=TABLES["TOKEN_POOL_TABLE"],
+        KeySchema=[
+            {"AttributeName": "pool", "KeyType": "HASH"},
+            {"AttributeName": "token_id", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            dict(AttributeName="pool", **string_key),
+            dict(AttributeName="token_id", **string_key),
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+    boto3.client("secretsmanager").create_secret(
+        Name=os.environ["API_SECRET_ARN"],
+        SecretString=json.dumps(
+            {
+                "JWT_SECRET": JWT_SECRET,
+                "API_KEY": "benchmark",
+                "USERNAME": "benchmark",
+                "PASSWORD": "benchmark",
+            }
+        ),
+    )
+
+    queue = boto3.client("sqs").create_queue(QueueName="benchmark-bulk-requests")
+    os.environ["QUEUE_URL"] = queue["QueueUrl"]
+
+
+def create_numbers(first, count):
+    """
+    Create distinct mobile numbers
+
+    Parameters
+    ----------
+    first: int
+        Offset of the first number
+    count: int
+        Number of mobile numbers
+    """
+
+    return [f"+91{7000000000 + first + i}" for i in range(count)]
+
+
+def benchmark_single_request(numbers, approval_delay):
+    """
+    Check every number through the single request handler in each phase of
+    its life: a new request, a pending request, the approval and a cache hit.
+    The pending check follows the new request right away, so it happens well
+    within the approval delay.
+    """
+
+    import single_request
+
+    def call(number):
+        body = json.dumps({"mobile_number": number})
+        return single_request.handler({"body": body}, FakeContext())
+
+    calls = []
+    for number in numbers:
+        calls.append(("new_request", call, (number,), 1, is_pending))
+        calls.append(("pending", call, (number,), 1, is_pending))
+    results = timed_calls(calls)
+
+    time.sleep(approval_delay)
+
+    calls = []
+    for number in numbers:
+        calls.append(("approved", call, (number,), 1, is_approved))
+    for number in numbers:
+        calls.append(("cache_hit", call, (number,), 1, is_approved))
+    results.update(timed_calls(calls))
+
+    return results
+
+
+def benchmark_queue_receiver(numbers, approval_delay):
+    """
+    Check numbers in batches through the queue receiver, first as new
+    requests and again once they are approved
+    """
+
+    import queue_receiver
+
+    def call(records):
+        return queue_receiver.handler({"Records": records}, FakeContext())
+
+    batches = []
+    for first in range(0, len(numbers), QUEUE_BATCH_SIZE):
+        last = first + QUEUE_BATCH_SIZE
+        batches.append(
+            [
+                {"messageId": str(index), "body": number}
+                for index, number in enumerate(numbers[first:last])
+            ]
+        )
+
+    calls = [("new_request", call, (b,), len(b), has_no_failures) for b in batches]
+    results = timed_calls(calls)
+
+    time.sleep(approval_delay)
+
+    calls = [("approved", call, (b,), len(b), has_no_failures) for b in batches]
+    results.update(timed_calls(calls))
+
+    return results
+
+
+def benchmark_bulk_request(numbers, repeat):
+    """Enqueue the same list of numbers through the bulk request handler"""
+
+    import bulk_request
+
+    event = {"body": json.dumps({"numbers": ",".join(numbers)})}
+    calls = [("enqueue", bulk_request.handler, (event, None), len(numbers), is_ok)]
+
+    return timed_calls(calls * repeat)
+
+
+def benchmark_scan_table(repeat):
+    """
+    Query the status index of the user status table through the scan table
+    handler, with the default page size and one small page at a time
+    """
+
+    import scan_table
+
+    from clients import dynamodb
+    from item_codec import encode_user_status
+
+    expdate = int(time.time()) + 86400
+    table = dynamodb().Table(TABLES["USER_STATUS_TABLE"])
+    with table.batch_writer() as batch:
+        for number in create_numbers(500000, SCAN_TABLE_ITEMS):
+            item = {
+                "mobile_number": number,
+                "message": APPROVED_STATUS["message"],
+                "colour": APPROVED_STATUS["color_code"],
+                "request_status": "Approved",
+                "expdate": expdate,
+            }
+            batch.put_item(Item=encode_user_status(item))
+
+    calls = [("query_all", scan_table.handler, ({}, None), SCAN_TABLE_ITEMS, is_ok)]
+    calls = calls * repeat
+
+    page_size = int(SCAN_PAGE_SIZE)
+    next_token = None
+    while True:
+        parameters = {"limit": SCAN_PAGE_SIZE}
+        if next_token:
+            parameters["next_token"] = next_token
+        response = scan_table.handler({"queryStringParameters": parameters}, None)
+        next_token = json.loads(response["body"])["next_token"]
+        event = {"queryStringParameters": parameters}
+        calls.append(
+            ("query_page", scan_table.handler, (event, None), page_size, is_ok)
+        )
+        if not next_token:
+            break
+
+    return timed_calls(calls)
+
+
+def run(args):
+    """Run every benchmark and return the results keyed by handler and phase"""
+
+    config = StubConfig(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        approval_delay=args.approval_delay,
+        error_rate=args.error_rate,
+    )
+    server, base_url, stub_state = start_stub_server(config)
+    configure_environment(base_url, args.rate_limit)
+
+    from moto import mock_aws
+
+    with mock_aws():
+        create_resources()
+
+        # gate checks lease tokens minted ahead of demand, like in production
+        from get_status import token_broker
+
+        token_broker.top_up(args.numbers * 2)
+
+        results = {}
+        numbers = create_numbers(0, args.numbers)
+        results["single_request"] = benchmark_single_request(
+            numbers, args.approval_delay
+        )
+        numbers = create_numbers(args.numbers, args.numbers)
+        results["queue_receiver"] = benchmark_queue_receiver(
+            numbers, args.approval_delay
+        )
+        results["bulk_request"] = benchmark_bulk_request(numbers, args.repeat)
+        results["scan_table"] = benchmark_scan_table(args.repeat)
+
+    server.shutdown()
+    print(f"Stub calls: {stub_state.calls}")
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Print the results next to the baseline. Returns the phases that
+    regressed.
+
+    Parameters
+    ----------
+    results: dict
+        Phase summaries keyed by handler and phase
+    baseline: dict
+        Stored phase summaries keyed by handler and phase
+    tolerance: float
+        Allowed slowdown as a fraction of the baseline
+    """
+
+    regressions = []
+    print(
+        f"{'phase':<30}{'calls':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        f"{'items/s':>10}{'base p95':>10}{'unexpected':>12}"
+    )
+
+    for handler, phases in results.items():
+        for phase, summary in phases.items():
+            name = f"{handler}.{phase}"
+            expected = baseline.get(name, {})
+            shown = expected.get("p95_ms", "-")
+            print(
+                f"{name:<30}{summary['calls']:>6}{summary['p50_ms']:>10.1f}"
+                f"{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}"
+                f"{summary['items_per_second']:>10.1f}{shown:>10}"
+                f"{summary['unexpected']:>12}"
+            )
+
+            for stat in COMPARED_STATS:
+                if stat not in expected:
+                    continue
+                if summary[stat] > expected[stat] * (1 + tolerance) + SLACK_MS:
+                    regressions.append(f"{name} {stat}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="store a new baseline")
+    parser.add_argument("--numbers", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--approval-delay", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=1000)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--output", help="also write the results to a json file")
+    parser.add_argument("--verbose", action="store_true", help="show handler logs")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    results = run(args)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    flat = {
+        f"{handler}.{phase}": summary
+        for handler, phases in results.items()
+        for phase, summary in phases.items()
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(flat, f, indent=2)
+            f.write("\n")
+
+    if args.update:
+        with open(args.baseline, "w") as f:
+            json.dump(flat, f, indent=2)
+            f.write("\n")
+        print(f"Stored baseline in {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"Regressed: {', '.join(regressions)}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""
+Measure the cold start import cost of every Lambda handler with
+python -X importtime and compare it with the stored baseline.
+
+Run from the repository root with the Lambda dependencies installed:
+
+    python benchmarks/import_time.py            # compare with the baseline
+    python benchmarks/import_time.py --update   # store a new baseline
+
+Exits with status 1 if a handler got slower than its baseline by more than
+the tolerance.
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# global variables
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda")
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "import_time_baseline.json")
+HANDLERS = [
+    "single_request",
+    "batch_request",
+    "bulk_request",
+    "queue_receiver",
+    "scan_table",
+    "mint_tokens",
+    "resolve_pending",
+]
+REPEAT = 5
+TOLERANCE = 0.25  # allowed slowdown as a fraction of the baseline
+SLACK_MS = 10  # allowed slowdown in milliseconds, absorbs noise of fast imports
+TOP_IMPORTS = 5
+
+
+def parse_importtime(output):
+    """
+    Parse the output of python -X importtime. Returns a list of tuples of
+    nesting depth, module name and cumulative time in milliseconds.
+
+    Parameters
+    ----------
+    output: str
+        Standard error of the python process
+    """
+
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        _, cumulative, name = line.split(":", 1)[1].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, name.strip(), int(cumulative) / 1000))
+
+    return entries
+
+
+def measure(handler, lambda_dir):
+    """
+    Import a handler in a fresh interpreter. Returns the cumulative import
+    time of the handler and of its direct imports in milliseconds.
+
+    Parameters
+    ----------
+    handler: str
+        Handler module name
+    lambda_dir: str
+        Directory the handler module is imported from
+    """
+
+    env = dict(os.environ)
+    env.setdefault("AWS_DEFAULT_REGION", "ap-south-1")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {handler}"],
+        cwd=lambda_dir,
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    entries = parse_importtime(process.stderr)
+
+    # a module is listed after its imports, so the direct imports of the
+    # handler are the entries one level deeper since the previous top level
+    children = {}
+    for depth, name, ms in entries:
+        if depth == 0 and name == handler:
+            return ms, children
+        if depth == 0:
+            children = {}
+        elif depth == 1:
+            children[name] = ms
+
+    raise RuntimeError(f"{handler} not found in -X importtime output")
+
+
+def benchmark(handlers, lambda_dir, repeat):
+    """
+    Measure every handler repeat times. Returns the median import time and
+    the heaviest direct imports of each handler.
+
+    Parameters
+    ----------
+    handlers: list
+        Handler module names
+    lambda_dir: str
+        Directory the handler modules are imported from
+    repeat: int
+        Number of measurements per handler
+    """
+
+    results = {}
+    for handler in handlers:
+        runs = [measure(handler, lambda_dir) for _ in range(repeat)]
+        children = sorted(runs[len(runs) // 2][1].items(), key=lambda c: -c[1])
+        results[handler] = {
+            "median_ms": round(statistics.median(total for total, _ in runs), 1),
+            "top_imports": children[:TOP_IMPORTS],
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="store a new baseline")
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--lambda-dir", default=LAMBDA_DIR)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    results = benchmark(HANDLERS, args.lambda_dir, args.repeat)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    regressions = []
+    print(f"{'handler':<18}{'median ms':>10}{'baseline':>10}  heaviest imports")
+    for handler, result in results.items():
+        median = result["median_ms"]
+        expected = baseline.get(handler)
+        top = ", ".join(f"{name} {ms:.0f}" for name, ms in result["top_imports"])
+        shown = "-" if expected is None else f"{expected:.1f}"
+        print(f"{handler:<18}{median:>10.1f}{shown:>10}  {top}")
+
+        if expected is not None and median > expected * (1 + args.tolerance) + SLACK_MS:
+            regressions.append(handler)
+
+    if args.update:
+        with open(args.baseline, "w") as f:
+            json.dump({h: r["median_ms"] for h, r in results.items()}, f, indent=2)
+            f.write("\n")
+        print(f"Stored baseline in {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"Import time regressed for: {', '.join(regressions)}")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
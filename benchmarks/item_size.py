@@ -0,0 +1,203 @@
+"""
+Compare the size and read cost of user status items in the long form they
+used to be stored in and the compact form of lambda/item_codec.py.
+
+For a sample of approved and rejected items it prints the average item and
+index entry size, the read capacity units a query of the status index uses
+and the time scan_table takes to deserialize and encode the items.
+
+    python benchmarks/item_size.py
+"""
+
+import os
+import sys
+import math
+import time
+import random
+import argparse
+
+from decimal import Decimal
+
+# global variables
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda")
+INDEX_ENTRY_OVERHEAD = 100  # bytes DynamoDB adds to every index entry
+READ_UNIT_BYTES = 4096
+APPROVED_STATUSES = [
+    {"message": "Low risk of infection", "color_code": "#00FF00"},
+    {"message": "Moderate risk of infection", "color_code": "#FFA500"},
+    {"message": "High risk of infection", "color_code": "#FF0000"},
+]
+REPEAT = 5
+
+
+def value_size(value):
+    """
+    Approximate the number of bytes DynamoDB bills for an attribute value
+
+    Parameters
+    ----------
+    value: str or int or Decimal
+        Attribute value
+    """
+
+    if isinstance(value, str):
+        return len(value.encode())
+
+    # one byte per two significant digits plus one
+    digits = str(abs(value)).replace(".", "").strip("0") or "0"
+    return math.ceil(len(digits) / 2) + 1
+
+
+def item_size(item, attributes=None):
+    """
+    Approximate the number of bytes DynamoDB bills for an item
+
+    Parameters
+    ----------
+    item: dict
+        Item attributes
+    attributes: list
+        Only count these attributes, all of them if None
+    """
+
+    names = item if attributes is None else [a for a in attributes if a in item]
+    return sum(len(name.encode()) + value_size(item[name]) for name in names)
+
+
+def create_items(count, rejected_share):
+    """
+    Create user status items in the shape create_user_status_item returns
+
+    Parameters
+    ----------
+    count: int
+        Number of items
+    rejected_share: float
+        Share of items that are rejected requests
+    """
+
+    from get_status import WHITE
+
+    expdate = int(time.time()) + 86400
+    items = []
+    for i in range(count):
+        if random.random() < rejected_share:
+            status = {
+                "message": "User as rejected request. Please create a new request",
+                "color_code": WHITE,
+            }
+            request_status = "Rejected"
+        else:
+            status = random.choice(APPROVED_STATUSES)
+            request_status = "Approved"
+
+        items.append(
+            {
+                "mobile_number": f"+91{9000000000 + i}",
+                "message": status["message"],
+                "colour": status["color_code"],
+                "expdate": expdate,
+                "request_status": request_status,
+            }
+        )
+
+    return items
+
+
+def read_cost(items, index_attributes):
+    """
+    Return the average item size, the average index entry size and the read
+    capacity units an eventually consistent query of every index entry uses
+
+    Parameters
+    ----------
+    items: list
+        Stored items
+    index_attributes: list
+        Keys and projected attributes of the status index
+    """
+
+    sizes = [item_size(item) for item in items]
+    entries = [
+        item_size(item, index_attributes) + INDEX_ENTRY_OVERHEAD for item in items
+    ]
+
+    # a query is billed on the total size it reads, in units of 4 KB
+    read_units = math.ceil(sum(entries) / READ_UNIT_BYTES) / 2
+
+    return sum(sizes) / len(sizes), sum(entries) / len(entries), read_units
+
+
+def encode_time(items, projection, repeat):
+    """
+    Return the median seconds scan_table takes to deserialize the projected
+    attributes of items from the DynamoDB wire format and encode them for
+    the frontend
+
+    Parameters
+    ----------
+    items: list
+        Stored items
+    projection: list
+        Attributes scan_table reads from the status index
+    repeat: int
+        Number of measurements
+    """
+
+    from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+    from scan_table import encode_item
+
+    serializer = TypeSerializer()
+    deserializer = TypeDeserializer()
+    wire = [{k: serializer.serialize(item[k]) for k in projection} for item in items]
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for raw in wire:
+            encode_item({k: deserializer.deserialize(v) for k, v in raw.items()})
+        timings.append(time.perf_counter() - start)
+
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--rejected-share", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    args = parser.parse_args()
+
+    os.environ.setdefault("AWS_DEFAULT_REGION", "ap-south-1")
+    sys.path.insert(0, LAMBDA_DIR)
+    from item_codec import encode_user_status
+
+    random.seed(0)
+    long_items = create_items(args.items, args.rejected_share)
+    # numbers read back from DynamoDB are Decimals
+    for item in long_items:
+        item["expdate"] = Decimal(item["expdate"])
+    compact_items = [encode_user_status(item) for item in long_items]
+
+    forms = [
+        ("long", long_items, ["request_status", "expdate"], ["message", "colour"]),
+        ("compact", compact_items, ["s", "expdate"], ["m", "c"]),
+    ]
+
+    print(
+        f"{'form':<10}{'item bytes':>12}{'index bytes':>13}"
+        f"{'query RCU':>11}{'encode ms':>11}"
+    )
+    for name, items, index_keys, projected in forms:
+        projection = ["mobile_number"] + projected
+        size, entry, read_units = read_cost(items, index_keys + projection)
+        seconds = encode_time(items, projection, args.repeat)
+        print(
+            f"{name:<10}{size:>12.1f}{entry:>13.1f}"
+            f"{read_units:>11.1f}{seconds * 1000:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+"""
+Checks of the state the handlers share across Lambda instances: the token
+bucket and circuit breaker items in the upstream state table and the cache
+tier in front of DynamoDB. They run in process against moto backed
+DynamoDB and the memory:// cache, with threads standing in for concurrent
+instances.
+
+Run from the repository root after installing benchmarks/requirements.txt:
+
+    python benchmarks/shared_state_checks.py
+
+Exits with status 1 if a check failed.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+
+# global variables
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIR = os.path.join(ROOT, "lambda")
+TABLES = {
+    "USER_STATUS_TABLE": "checks-user-status",
+    "REQUESTS_TABLE": "checks-requests",
+    "UPSTREAM_STATE_TABLE": "checks-upstream-state",
+}
+INSTANCES = 8  # threads standing in for concurrent lambda instances
+BUCKET_RATE = 20
+BUCKET_ACQUIRES = 10  # acquires made by every instance
+MOBILE_NUMBER = "+917000000001"
+
+
+def configure_environment():
+    """
+    Point the handler modules at the moto tables. Must run before they are
+    imported because they read the environment on import.
+    """
+
+    os.environ.update(
+        {
+            "AWS_DEFAULT_REGION": "ap-south-1",
+            "AWS_ACCESS_KEY_ID": "checks",
+            "AWS_SECRET_ACCESS_KEY": "checks",
+            "API_SECRET_ARN": "checks-api-secret",
+        }
+    )
+    os.environ.update(TABLES)
+    os.environ.pop("CACHE_URL", None)
+    sys.path.insert(0, LAMBDA_DIR)
+
+
+def create_tables():
+    """Create the tables the checks use in moto"""
+
+    import boto3
+
+    dynamodb = boto3.client("dynamodb")
+    for name, key in (
+        ("USER_STATUS_TABLE", "mobile_number"),
+        ("REQUESTS_TABLE", "mobile_number"),
+        ("UPSTREAM_STATE_TABLE", "name"),
+    ):
+        dynamodb.create_table(
+            TableName=TABLES[name],
+            KeySchema=[{"AttributeName": key, "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": key, "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+
+def run_instances(target, count=INSTANCES):
+    """
+    Run a function in count threads that start together. Returns the result
+    of every thread.
+
+    Parameters
+    ----------
+    target: callable
+        Function called with the index of the thread
+    count: int
+        Number of threads
+    """
+
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def run(index):
+        barrier.wait()
+        results[index] = target(index)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def check_bucket_conflict():
+    """
+    A write of the token bucket based on a stale read loses to the caller
+    that updated the bucket first and is reported as a conflict
+    """
+
+    from clients import dynamodb
+    from rate_limiter import CONFLICT, DynamoDBTokenBucket
+
+    table_name = TABLES["UPSTREAM_STATE_TABLE"]
+    first = DynamoDBTokenBucket("conflict", BUCKET_RATE, table_name)
+    second = DynamoDBTokenBucket("conflict", BUCKET_RATE, table_name)
+    table = dynamodb().Table(table_name)
+
+    first._take(0, time.time())
+    state, condition = first._read(table, time.time())
+    if second._take(0, time.time()) is not None:
+        return ["second caller did not get a token"]
+
+    errors = []
+    tokens, _, rate_factor = state
+    if first._write(table, (tokens - 1, time.time(), rate_factor), condition):
+        errors.append("stale write replaced the bucket")
+
+    # a take racing with another caller reports the conflict
+    read = first._read
+    first._read = lambda table, now: (state, condition)
+    if first._take(0, time.time()) is not CONFLICT:
+        errors.append("stale take was not reported as a conflict")
+    first._read = read
+
+    return errors
+
+
+def check_bucket_shared():
+    """
+    Concurrent instances sharing a token bucket never take more tokens than
+    it holds plus what it earns while they run, and conflicting writes do
+    not keep them from taking the tokens that are there
+    """
+
+    from rate_limiter import INTERACTIVE, DynamoDBTokenBucket
+
+    table_name = TABLES["UPSTREAM_STATE_TABLE"]
+    conflicts = []
+    buckets = []
+    for _ in range(INSTANCES):
+        bucket = DynamoDBTokenBucket("shared", BUCKET_RATE, table_name)
+        write = bucket._write
+
+        def counted_write(*args, write=write):
+            written = write(*args)
+            if not written:
+                conflicts.append(1)
+            return written
+
+        bucket._write = counted_write
+        buckets.append(bucket)
+
+    # callers wait for tokens, so conflicting writes are retried
+    def acquire(index):
+        return [buckets[index].acquire(INTERACTIVE) for _ in range(BUCKET_ACQUIRES)]
+
+    start = time.time()
+    results = run_instances(acquire)
+    elapsed = time.time() - start
+
+    taken = sum(sum(result) for result in results)
+    allowed = buckets[0].capacity + BUCKET_RATE * elapsed
+
+    errors = []
+    if taken > allowed:
+        errors.append(f"took {taken} tokens, at most {allowed:.1f} were available")
+    if taken < buckets[0].capacity:
+        errors.append(f"took {taken} tokens of a full bucket of {buckets[0].capacity}")
+    print(f"  {taken} tokens taken, {len(conflicts)} conflicting writes")
+
+    return errors
+
+
+def open_breakers(name, count=INSTANCES):
+    """
+    Create breakers for count instances that are open for longer than
+    OPEN_SECONDS, so the next allowed call is the trial call
+
+    Parameters
+    ----------
+    name: str
+        Breaker name
+    count: int
+        Number of instances
+    """
+
+    from circuit_breaker import OPEN, OPEN_SECONDS, CircuitBreaker
+
+    opened_at = time.time() - OPEN_SECONDS - 1
+    breakers = []
+    for _ in range(count):
+        breaker = CircuitBreaker(name, TABLES["UPSTREAM_STATE_TABLE"])
+        breaker.state = OPEN
+        breaker.opened_at = opened_at
+        breaker._synced_at = time.time()  # as if it read the open state
+        breakers.append(breaker)
+
+    return breakers
+
+
+def check_breaker_trial():
+    """
+    Once the breaker has been open for OPEN_SECONDS, exactly one of the
+    instances racing for the trial call gets it
+    """
+
+    from circuit_breaker import HALF_OPEN
+
+    breakers = open_breakers("trial")
+    breakers[0]._write()
+
+    allowed = run_instances(lambda index: breakers[index].allow())
+    if sum(allowed) != 1:
+        return [f"{sum(allowed)} instances made the trial call"]
+
+    trial = breakers[allowed.index(True)]
+    if trial.state != HALF_OPEN:
+        return [f"trial instance is {trial.state}"]
+
+    return []
+
+
+def check_breaker_missing_state():
+    """
+    The trial call is still claimed if opening the breaker could not be
+    written, and only by one instance
+    """
+
+    breakers = open_breakers("missing")
+
+    allowed = run_instances(lambda index: breakers[index].allow())
+    if sum(allowed) != 1:
+        return [f"{sum(allowed)} instances made the trial call"]
+
+    return []
+
+
+class DownBackend:
+    """Cache backend whose every call fails, like an unreachable cache"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def _fail(self, *args):
+        from cache_tier import CacheError
+
+        self.calls += 1
+        raise CacheError("Cache is down")
+
+    get_many = set_many = delete_many = _fail
+
+
+def store_user_status(envvar):
+    """
+    Store an approved user status of MOBILE_NUMBER in DynamoDB
+
+    Parameters
+    ----------
+    envvar: EnvVar
+        Object contains environment variables
+    """
+
+    from clients import dynamodb
+    from get_status import APPROVED, create_user_status_item
+    from item_codec import encode_user_status
+
+    item = create_user_status_item(
+        MOBILE_NUMBER, {"message": "Approved", "color_code": "#00FF00"}, APPROVED
+    )
+    dynamodb().Table(envvar.USER_STATUS_TABLE).put_item(Item=encode_user_status(item))
+
+    return item
+
+
+def check_cache_fallback():
+    """
+    Lookups read through the memory:// cache while it is up and fall back to
+    DynamoDB while it is down, without raising and without retrying the
+    cache on every call
+    """
+
+    import get_status
+    from cache_tier import USER_STATUS, create_cache_tier
+
+    envvar = get_status.EnvVar()
+    item = store_user_status(envvar)
+    errors = []
+
+    # a lookup through a working cache writes the status to it
+    get_status.cache_tier = create_cache_tier("memory://")
+    get_status.lookup_mobile_numbers([MOBILE_NUMBER], envvar)
+    if get_status.cache_tier.get(USER_STATUS, MOBILE_NUMBER) is None:
+        errors.append("status read from DynamoDB was not cached")
+
+    # while the cache is down the status still comes from DynamoDB
+    backend = DownBackend()
+    get_status.cache_tier.backend = backend
+    for _ in range(3):
+        entry, _ = get_status.lookup_mobile_numbers([MOBILE_NUMBER], envvar)[
+            MOBILE_NUMBER
+        ]
+        if entry is None or entry["message"] != item["message"]:
+            errors.append(f"lookup with the cache down returned {entry}")
+            break
+    get_status.cache_tier.put(USER_STATUS, item)
+
+    if get_status.cache_tier.available:
+        errors.append("cache is not skipped after it failed")
+    if backend.calls != 1:
+        errors.append(f"cache was called {backend.calls} times while down")
+
+    return errors
+
+
+CHECKS = [
+    check_bucket_conflict,
+    check_bucket_shared,
+    check_breaker_trial,
+    check_breaker_missing_state,
+    check_cache_fallback,
+]
+
+
+def main():
+    configure_environment()
+
+    # the handlers log every rejected call and cache failure
+    logging.disable(logging.ERROR)
+
+    from moto import mock_aws
+
+    failed = []
+    with mock_aws():
+        create_tables()
+
+        for check in CHECKS:
+            print(check.__name__)
+            errors = check()
+            for error in errors:
+                print(f"  FAILED: {error}")
+            if errors:
+                failed.append(check.__name__)
+
+    print(f"{len(CHECKS) - len(failed)} of {len(CHECKS)} checks passed")
+    return int(bool(failed))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
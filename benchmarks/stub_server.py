@@ -0,0 +1,144 @@
+"""
+Local stand-in for the three Aarogya Setu endpoints used by the benchmarks.
+
+Every response is delayed by a configurable latency, a configurable share
+of the requests fail with 503, and a request is approved once a
+configurable delay has passed since it was created.
+"""
+
+import json
+import time
+import uuid
+import random
+import threading
+
+import jwt
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# global variables
+JWT_SECRET = "benchmark-jwt-secret"
+APPROVED_STATUS = {"message": "Low risk", "color_code": "#00FF00"}
+
+
+class StubConfig:
+    """
+    Behaviour of the stub endpoints
+
+    Attributes
+    ----------
+    latency: float
+        Seconds every response is delayed by
+    jitter: float
+        Maximum number of seconds added to the latency at random
+    approval_delay: float
+        Seconds after which a new request is approved
+    error_rate: float
+        Share of requests that fail with 503
+    """
+
+    def __init__(self, latency=0.05, jitter=0.02, approval_delay=1.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.approval_delay = approval_delay
+        self.error_rate = error_rate
+
+
+class StubState:
+    """Requests created on the stub and counters of the calls it served"""
+
+    def __init__(self):
+        self.requests = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def count(self, path):
+        with self.lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+
+def create_handler(config, state):
+    """
+    Create a request handler class bound to a config and a state
+
+    Parameters
+    ----------
+    config: StubConfig
+        Behaviour of the endpoints
+    state: StubState
+        Shared state of the stub
+    """
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            state.count(self.path)
+
+            time.sleep(config.latency + random.uniform(0, config.jitter))
+
+            if random.random() < config.error_rate:
+                return self.respond(503, {"message": "Service Unavailable"})
+
+            if self.path == "/token":
+                return self.respond(200, {"token": uuid.uuid4().hex})
+
+            if self.path == "/userstatus":
+                request_id = uuid.uuid4().hex
+                with state.lock:
+                    state.requests[request_id] = time.time()
+                return self.respond(200, {"requestId": request_id})
+
+            if self.path == "/userstatusbyreqid":
+                created_at = state.requests.get(body.get("requestId"))
+                if created_at is None:
+                    return self.respond(404, {"message": "Unknown request"})
+                if time.time() - created_at < config.approval_delay:
+                    return self.respond(200, {"request_status": "Pending"})
+
+                as_status = jwt.encode(
+                    {"as_status": APPROVED_STATUS}, JWT_SECRET, algorithm="HS256"
+                )
+                if isinstance(as_status, bytes):
+                    as_status = as_status.decode()
+                return self.respond(
+                    200, {"request_status": "Approved", "as_status": as_status}
+                )
+
+            return self.respond(404, {"message": "Not found"})
+
+        def respond(self, status_code, body):
+            content = json.dumps(body).encode()
+            self.send_response(status_code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def start_stub_server(config):
+    """
+    Start the stub on a free local port in a background thread. Returns the
+    server, its base url and its state.
+
+    Parameters
+    ----------
+    config: StubConfig
+        Behaviour of the endpoints
+    """
+
+    state = StubState()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), create_handler(config, state))
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server, f"http://127.0.0.1:{server.server_port}", state
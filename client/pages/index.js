@@ -85,27 +85,47 @@ function Home() {
   };
 
   const handleRefresh = async () => {
-    setLoading(true);
-    setMessage(false);
-    setError(false);
-
-    const user = await Auth.currentAuthenticatedUser();
-    const token = user.signInUserSession.idToken.jwtToken;
+    try {
+      setLoading(true);
+      setMessage(false);
+      setError(false);
 
-    const res = await (
-      await fetch(scan_url, {
-        headers: { Authorization: token },
-      })
-    ).json();
+      const user = await Auth.currentAuthenticatedUser();
+      const token = user.signInUserSession.idToken.jwtToken;
 
-    if (Math.random() < 0.1) {
+      // statuses are returned a page at a time, follow next_token to the end
+      const items = [];
+      let next_token = null;
+      do {
+        const url = next_token
+          ? `${scan_url}?next_token=${encodeURIComponent(next_token)}`
+          : scan_url;
+        const response = await fetch(url, {
+          headers: { Authorization: token },
+        });
+        const res = await response.json();
+
+        if (!response.ok || !Array.isArray(res.items)) {
+          throw new Error(`Failed to read statuses: ${response.status}`);
+        }
+
+        items.push(...res.items);
+        next_token = res.next_token;
+      } while (next_token);
+
+      if (Math.random() < 0.1) {
+        setError("An error occurred");
+        setData([]);
+      } else {
+        setData(items);
+      }
+    } catch (e) {
+      console.error(e);
       setError("An error occurred");
       setData([]);
-    } else {
-      setData(res);
+    } finally {
+      setLoading(false);
     }
-
-    setLoading(false);
   };
 
   return (
@@ -1,49 +1,279 @@
-import zipfile
 import os
+import sys
+import time
+import shutil
+import hashlib
+import zipfile
+import tempfile
+import subprocess
 
 from pip._internal import main as pip_main
 
+# global variables
+REQUIREMENTS_FILE_PATH = os.path.join("lambda", "requirements.txt")
+BUILD_DIRECTORY = "build"
+LAYER_NAME = "dependency-layer"
+LAYER_PYTHON_VERSION = (3, 7)  # must match the runtime of the lambda functions
+LAYER_PLATFORM = "manylinux2014_x86_64"
+LAYER_BUILD_VERSION = "4"  # bump to rebuild layers when the build steps change
+STRIPPED_DIRECTORIES = ("__pycache__", "tests", "test", "bin")
+STRIPPED_DIRECTORY_SUFFIXES = (".dist-info", ".egg-info")
+STRIPPED_FILE_SUFFIXES = (".pyc", ".pyo", ".pyi", ".c", ".h", ".pyx")
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+LAYER_RUNTIME_DIRECTORY = "/opt/python"  # where lambda extracts the packages
+
+
+def layer_hash():
+    """
+    Hash of everything the layer is built from, so that a layer is rebuilt
+    whenever the requirements, the target runtime or the build steps change
+    """
+
+    digest = hashlib.sha256()
+    with open(REQUIREMENTS_FILE_PATH, "rb") as f:
+        digest.update(f.read())
+    digest.update(repr(LAYER_PYTHON_VERSION).encode())
+    digest.update(LAYER_PLATFORM.encode())
+    digest.update(LAYER_BUILD_VERSION.encode())
+
+    return digest.hexdigest()[:16]
+
+
+def install_dependencies(target_directory):
+    """
+    Install the requirements for the layer runtime in a target directory
+
+    Parameters
+    ----------
+    target_directory: str
+        Directory the packages are installed in
+    """
+
+    status = pip_main(
+        [
+            "install",
+            "-r",
+            REQUIREMENTS_FILE_PATH,
+            "--require-hashes",
+            "--no-deps",
+            "--target",
+            target_directory,
+            "--platform",
+            LAYER_PLATFORM,
+            "--python-version",
+            "".join(str(v) for v in LAYER_PYTHON_VERSION),
+            "--implementation",
+            "cp",
+            "--only-binary=:all:",
+            "--no-compile",
+            "--quiet",
+        ]
+    )
+
+    if status:
+        raise RuntimeError(f"Failed to install {REQUIREMENTS_FILE_PATH}")
+
+
+def strip_directory(target_directory):
+    """
+    Remove files that are not needed at runtime such as package metadata,
+    tests and byte code compiled for another interpreter
+
+    Parameters
+    ----------
+    target_directory: str
+        Directory the packages are installed in
+    """
+
+    for root, dirs, files in os.walk(target_directory):
+        for directory in list(dirs):
+            if directory in STRIPPED_DIRECTORIES or directory.endswith(
+                STRIPPED_DIRECTORY_SUFFIXES
+            ):
+                shutil.rmtree(os.path.join(root, directory))
+                dirs.remove(directory)
+
+        for file in files:
+            if file.endswith(STRIPPED_FILE_SUFFIXES):
+                os.remove(os.path.join(root, file))
+
+
+def interpreter_version(python):
+    """
+    Get the version of a python interpreter as a tuple of major and minor
+    version. Returns None if it cannot be run.
+
+    Parameters
+    ----------
+    python: str
+        Path or name of the interpreter
+    """
+
+    try:
+        output = subprocess.run(
+            [python, "-c", "import sys; print(*sys.version_info[:2])"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            universal_newlines=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return tuple(int(v) for v in output.split())
+
+
+def find_layer_python():
+    """
+    Find an interpreter of the layer runtime version to precompile the
+    packages with, as byte code of any other version would never be used.
+    The LAYER_PYTHON environment variable is tried first, then this
+    interpreter and python3.7 on the path. Raises RuntimeError if none
+    matches, so a layer is never built without its byte code.
+    """
+
+    name = "python" + ".".join(str(v) for v in LAYER_PYTHON_VERSION)
+    candidates = [os.environ.get("LAYER_PYTHON"), sys.executable, shutil.which(name)]
+
+    for python in candidates:
+        if python and interpreter_version(python) == LAYER_PYTHON_VERSION:
+            return python
+
+    raise RuntimeError(
+        f"Building the dependency layer needs {name} to precompile the packages, "
+        f"install it or set LAYER_PYTHON to its path"
+    )
+
+
+def compile_directory(target_directory):
+    """
+    Precompile the packages with an interpreter of the layer runtime
+    version. Hash based pyc files are used because they do not depend on
+    file modification times, and they are not checked against the source as
+    the layer is read only. Source paths are recorded as they are at runtime
+    and the hash seed is fixed, so the same packages give the same pyc files.
+
+    Parameters
+    ----------
+    target_directory: str
+        Directory the packages are installed in
+    """
+
+    python = find_layer_python()
+
+    status = subprocess.run(
+        [
+            python,
+            "-m",
+            "compileall",
+            "-q",
+            "--invalidation-mode",
+            "unchecked-hash",
+            "-d",
+            LAYER_RUNTIME_DIRECTORY,
+            target_directory,
+        ],
+        env={**os.environ, "PYTHONHASHSEED": "0"},
+    ).returncode
+
+    if status:
+        raise RuntimeError(f"Failed to precompile {target_directory} with {python}")
+
+
+def write_zip(source_directory, zip_file_path):
+    """
+    Package a directory as a zip file. Entries are sorted and get a fixed
+    time stamp and permissions, so the same files always give the same zip.
+
+    Parameters
+    ----------
+    source_directory: str
+        Directory whose contents are packaged, paths are relative to it
+    zip_file_path: str
+        Path of the zip file
+    """
+
+    paths = []
+    for root, dirs, files in os.walk(source_directory):
+        for file in files:
+            paths.append(os.path.join(root, file))
+
+    with zipfile.ZipFile(zip_file_path, "w", zipfile.ZIP_DEFLATED) as dep_zip:
+        for file_path in sorted(paths):
+            name = os.path.relpath(file_path, source_directory).replace(os.sep, "/")
+            info = zipfile.ZipInfo(name, ZIP_DATE_TIME)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+
+            with open(file_path, "rb") as f:
+                dep_zip.writestr(info, f.read(), compresslevel=9)
+
+
+def report(zip_file_path):
+    """
+    Print the size of a layer and the time it takes to unzip it, which
+    Lambda pays for on every cold start
+
+    Parameters
+    ----------
+    zip_file_path: str
+        Path of the layer zip file
+    """
+
+    with zipfile.ZipFile(zip_file_path) as dep_zip:
+        entries = dep_zip.infolist()
+        unzipped_size = sum(entry.file_size for entry in entries)
+
+        with tempfile.TemporaryDirectory() as directory:
+            start = time.perf_counter()
+            dep_zip.extractall(directory)
+            unzip_seconds = time.perf_counter() - start
+
+    print(
+        f"{zip_file_path}: {len(entries)} files, "
+        f"{os.path.getsize(zip_file_path) / 1024:.0f} KiB zipped, "
+        f"{unzipped_size / 1024:.0f} KiB unzipped, "
+        f"unzipped in {unzip_seconds * 1000:.0f} ms"
+    )
+
 
 def create_dependency_layer():
     """
     Installs dependencies in a target directory and then
     packages it into a zip file that can be used by CDK
-    to create Lambda dependency layer
+    to create Lambda dependency layer. The zip is named after a hash of
+    the requirements and only rebuilt when the hash changes. Returns the
+    path of the zip file.
     """
 
-    # file paths
-    requirements_file_path = "requirements.txt"
-    target_directory = "python"
-    zip_file_path = "dependency-layer.zip"
+    zip_file_path = os.path.join(BUILD_DIRECTORY, f"{LAYER_NAME}-{layer_hash()}.zip")
 
-    # change directory so that relative paths work
-    cwd = os.getcwd()
-    os.chdir("lambda")
+    if os.path.isfile(zip_file_path):
+        print(f"{zip_file_path} is up to date")
+        return zip_file_path
 
-    # create new dependency zip only if it doesn't exist
-    if not os.path.isfile(zip_file_path):
+    os.makedirs(BUILD_DIRECTORY, exist_ok=True)
 
-        pip_main(
-            [
-                "install",
-                "-r",
-                requirements_file_path,
-                "--target",
-                target_directory,
-            ]
-        )
+    # layers that were built from other requirements are stale
+    for file in os.listdir(BUILD_DIRECTORY):
+        if file.startswith(f"{LAYER_NAME}-") and file.endswith(".zip"):
+            os.remove(os.path.join(BUILD_DIRECTORY, file))
 
-        # package dependencies as a zip file
-        dep_zip = zipfile.ZipFile(zip_file_path, "w", zipfile.ZIP_DEFLATED)
+    with tempfile.TemporaryDirectory() as directory:
+        # packages must be under python/ to be on the path of the runtime
+        target_directory = os.path.join(directory, "python")
+        install_dependencies(target_directory)
+        strip_directory(target_directory)
+        compile_directory(target_directory)
 
-        for root, dirs, files in os.walk(target_directory):
-            for file in files:
-                dep_zip.write(os.path.join(root, file))
+        # write to a temporary file so a failed build never looks up to date
+        partial_zip_file_path = zip_file_path + ".partial"
+        write_zip(directory, partial_zip_file_path)
+        os.replace(partial_zip_file_path, zip_file_path)
 
-        dep_zip.close()
+    report(zip_file_path)
 
-    # change directory back
-    os.chdir(cwd)
+    return zip_file_path
 
 
 if __name__ == "__main__":
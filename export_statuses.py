@@ -0,0 +1,174 @@
+"""
+Export every unexpired user status as a JSON list, for example for a
+backup or an audit. This is run by an operator with their own credentials
+and is not exposed through the API, where /scan only returns pages.
+
+The user status table is scanned in parallel segments and every item is
+written to the output file as soon as its page is read, so memory stays
+flat however large the table is.
+
+    python export_statuses.py --table <UserStatusTable> --output statuses.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+
+import boto3
+
+from datetime import datetime
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+
+# global variables
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lambda")
+SEGMENTS = 4
+RETRY_CONFIG = Config(retries={"mode": "standard", "max_attempts": 10})
+
+
+class Writer:
+    """
+    Write items to a JSON list one at a time from several threads
+
+    Attributes
+    ----------
+    file: file
+        File the list is written to
+    count: int
+        Number of items written so far
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def write(self, fragments):
+        """
+        Append encoded items to the list
+
+        Parameters
+        ----------
+        fragments: list
+            Items encoded as JSON
+        """
+
+        with self._lock:
+            for fragment in fragments:
+                self.file.write(",\n" if self.count else "[\n")
+                self.file.write(fragment)
+                self.count += 1
+
+    def close(self):
+        """
+        End the list
+        """
+
+        self.file.write("\n]\n" if self.count else "[]\n")
+
+
+def export_segment(args, writer, segment, segments, now):
+    """
+    Scan one segment of the user status table and write its unexpired items.
+    Returns the number of items scanned.
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        Command line arguments
+    writer: Writer
+        Output of the export
+    segment: int
+        Segment scanned by this call
+    segments: int
+        Number of segments the table is split into
+    now: int
+        Timestamp items expiring before are skipped
+    """
+
+    from item_codec import decode_user_status
+
+    # boto3 resources are not thread safe, every segment gets its own
+    session = boto3.session.Session()
+    table = session.resource(
+        "dynamodb", endpoint_url=args.endpoint_url, config=RETRY_CONFIG
+    ).Table(args.table)
+
+    kwargs = {"Segment": segment, "TotalSegments": segments}
+    scanned = 0
+
+    while True:
+        page = table.scan(**kwargs)  # returns a payload of max 1 MB
+        scanned += page["ScannedCount"]
+
+        fragments = [
+            json.dumps(decode_user_status(item), default=int)
+            for item in page["Items"]
+            if int(item["expdate"]) >= now
+        ]
+        writer.write(fragments)
+
+        if "LastEvaluatedKey" not in page:
+            return scanned
+        kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+
+def export(args, file):
+    """
+    Export the user status table to a file. Returns the number of items
+    scanned and written.
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        Command line arguments
+    file: file
+        File the JSON list is written to
+    """
+
+    # user statuses are decoded with the codec of the handlers
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+
+    writer = Writer(file)
+    now = int(datetime.now().timestamp())
+
+    with ThreadPoolExecutor(max_workers=args.segments) as executor:
+        scanned = sum(
+            executor.map(
+                lambda segment: export_segment(
+                    args, writer, segment, args.segments, now
+                ),
+                range(args.segments),
+            )
+        )
+
+    writer.close()
+    return scanned, writer.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--output", default="-", help="defaults to stdout")
+    parser.add_argument("--segments", type=int, default=SEGMENTS)
+    parser.add_argument("--endpoint-url", help="for DynamoDB Local or moto")
+    args = parser.parse_args()
+
+    if args.output == "-":
+        scanned, written = export(args, sys.stdout)
+    else:
+        # write to a temporary file so a failed export never leaves a broken file
+        partial_path = args.output + ".partial"
+        with open(partial_path, "w") as f:
+            scanned, written = export(args, f)
+        os.replace(partial_path, args.output)
+
+    print(f"{args.table}: scanned {scanned}, exported {written}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+import os
+import json
+import logging
+import metrics
+
+from bulk_request import prepare_numbers
+from deadline import Deadline
+from get_status import (
+    PENDING_MESSAGE,
+    cache_tier,
+    check_mobile_numbers,
+    create_return_response,
+    status_cache,
+    upstream_stats,
+)
+from profiling import profiled
+
+# global variables
+BATCH_MAX_NUMBERS = int(os.environ.get("BATCH_MAX_NUMBERS", 50))
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def parse_numbers(body):
+    """
+    Read the mobile numbers of a request body. Numbers are given as a list
+    or, like the bulk request, as a comma separated string. Returns None if
+    the body holds no numbers.
+
+    Parameters
+    ----------
+    body: str
+        Request body of the format {"numbers": ["+91XXXXXXXXXX", ...]}
+    """
+
+    try:
+        numbers = json.loads(body or "{}").get("numbers")
+    except (ValueError, AttributeError):
+        return None
+
+    if isinstance(numbers, str):
+        numbers = numbers.split(",")
+    if not isinstance(numbers, list) or not numbers:
+        return None
+
+    return numbers
+
+
+def create_result(number, return_response):
+    """
+    Create the result of a mobile number from the response check_mobile_numbers
+    returned for it. Numbers that could not be checked before the deadline
+    and numbers still waiting for the user to approve the request are
+    marked pending, the caller can check them again later.
+
+    Parameters
+    ----------
+    number: str
+        User mobile number of the format "+91XXXXXXXXXX"
+    return_response: dict or Exception
+        Return response of the number or the exception raised for it
+    """
+
+    if isinstance(return_response, Exception):
+        logger.error(f"Failed to check {number}.\n{return_response}")
+        return {
+            "mobile_number": number,
+            "message": "Status check is pending. Please try again",
+            "colour": "#FFFFFF",
+            "pending": True,
+        }
+
+    result = json.loads(return_response["body"])
+    result["pending"] = (
+        return_response["statusCode"] != 200 or result["message"] == PENDING_MESSAGE
+    )
+    return result
+
+
+@profiled
+def handler(event, context):
+    """
+    Receive a list of up to BATCH_MAX_NUMBERS mobile numbers and check them
+    concurrently. Format is {"numbers": ["+91XXXXXXXXXX", "+91XXXXXXXXXX"]}.
+    Numbers are validated and deduplicated like the bulk request, then
+    resolved like the single request within the time the invocation has
+    left. Returns the result of every accepted number in their original
+    order and the rejected numbers.
+
+    Parameters
+    ----------
+    event: dict
+        event parameters passed to function
+    context: dict
+        context parameters passed to function
+    """
+
+    numbers = parse_numbers(event.get("body"))
+    if numbers is None:
+        body = json.dumps({"message": "Request body must list numbers"})
+        return create_return_response(400, body)
+    if len(numbers) > BATCH_MAX_NUMBERS:
+        message = f"At most {BATCH_MAX_NUMBERS} numbers can be checked at once"
+        return create_return_response(400, json.dumps({"message": message}))
+
+    accepted, rejected = prepare_numbers(numbers)
+
+    # numbers left when the deadline runs out are returned as pending
+    deadline = Deadline.from_context(context)
+    return_responses = []
+    if accepted:
+        return_responses = check_mobile_numbers(
+            accepted, return_exceptions=True, deadline=deadline
+        )
+
+    results = [
+        create_result(number, return_response)
+        for number, return_response in zip(accepted, return_responses)
+    ]
+    pending = sum(result["pending"] for result in results)
+    logger.info(
+        f"Checked {len(results) - pending} of {len(results)} numbers, "
+        f"{pending} pending, {len(rejected)} rejected"
+    )
+    logger.info(upstream_stats())
+    logger.info(status_cache.stats())
+    logger.info(cache_tier.stats())
+    logger.info(metrics.snapshot())
+    metrics.emit()
+
+    body = json.dumps({"results": results, "rejected": rejected})
+    return create_return_response(200, body)
@@ -1,11 +1,19 @@
 import json
-import boto3
+import time
 import os
 import logging
 
 from botocore.exceptions import ClientError
+from clients import client
+from concurrent.futures import ThreadPoolExecutor
+from mobile_number import normalise_mobile_number
+from profiling import profiled
 
-sqs = boto3.resource("sqs")
+# global variables
+SEND_BATCH_SIZE = 10  # maximum number of messages in a send_message_batch call
+SEND_WORKERS = int(os.environ.get("SEND_WORKERS", 8))
+
+executor = ThreadPoolExecutor(max_workers=SEND_WORKERS)
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -45,10 +53,77 @@ def create_return_status(status_code, body):
     }
 
 
+def prepare_numbers(raw_numbers):
+    """
+    Normalise mobile numbers and drop invalid and duplicate ones. Returns
+    a tuple of the accepted numbers in their original order and a list of
+    rejected numbers with the reason they were rejected.
+
+    Parameters
+    ----------
+    raw_numbers: list
+        Mobile numbers as entered by the user, anything other than a string
+        is rejected as invalid
+    """
+
+    accepted = []
+    rejected = []
+    seen = set()
+
+    for raw_number in raw_numbers:
+        # numbers given as json may be of any type
+        number = None
+        if isinstance(raw_number, str):
+            number = normalise_mobile_number(raw_number)
+
+        if number is None:
+            rejected.append({"number": raw_number, "reason": "Invalid mobile number"})
+        elif number in seen:
+            rejected.append({"number": raw_number, "reason": "Duplicate mobile number"})
+        else:
+            seen.add(number)
+            accepted.append(number)
+
+    return accepted, rejected
+
+
+def send_batch(queue_url, numbers):
+    """
+    Send up to SEND_BATCH_SIZE numbers to the queue in a single call.
+    Returns the numbers that could not be added to the queue.
+
+    Parameters
+    ----------
+    queue_url: str
+        Url of the bulk request queue
+    numbers: list
+        Mobile numbers of the format "+91XXXXXXXXXX"
+    """
+
+    entries = [
+        {"Id": str(i), "MessageBody": number} for i, number in enumerate(numbers)
+    ]
+
+    try:
+        response = client("sqs").send_message_batch(QueueUrl=queue_url, Entries=entries)
+    except ClientError as e:
+        logger.error(f"Failed to add {numbers} to queue.\n{e}")
+        return numbers
+
+    failed = [numbers[int(entry["Id"])] for entry in response.get("Failed", [])]
+    if failed:
+        logger.error(f"Failed to add {failed} to queue.\n{response['Failed']}")
+
+    return failed
+
+
+@profiled
 def handler(event, context):
     """
     Receive comma separated mobile numbers and push them into a queue.
-    Format is "+91XXXXXXXXXX,+91XXXXXXXXXX"
+    Format is "+91XXXXXXXXXX,+91XXXXXXXXXX". Numbers are validated and
+    deduplicated, then sent in batches of SEND_BATCH_SIZE from a thread pool.
+    Returns a report of accepted, rejected and failed numbers.
 
     Parameters
     ----------
@@ -58,25 +133,31 @@ def handler(event, context):
         context parameters passed to function
     """
 
-    queue = sqs.Queue(os.environ["QUEUE_URL"])
+    queue_url = os.environ["QUEUE_URL"]
     numbers = json.loads(event["body"])["numbers"]
-    failed = []
 
-    # upload numbers to queue one at a time
-    for number in numbers.split(","):
-        try:
-            queue.send_message(MessageBody=number)
-        except ClientError as e:
-            logger.error(f"Failed to add {number} to queue.\n{e}")
-            failed.append(number)
-        else:
-            logger.info(f"Added to queue {number}")
+    accepted, rejected = prepare_numbers(numbers.split(","))
+    batches = []
+    for first in range(0, len(accepted), SEND_BATCH_SIZE):
+        last = first + SEND_BATCH_SIZE
+        batches.append(accepted[first:last])
 
-    if failed:
-        failed_numbers = ",".join(failed)
-        body = json.dumps(f"Failed to add upload numbers: {failed_numbers}")
-    else:
-        body = json.dumps("Succesfully uploaded all numbers")
+    # upload batches to queue in parallel
+    start = time.perf_counter()
+    failed = []
+    for failed_numbers in executor.map(lambda b: send_batch(queue_url, b), batches):
+        failed.extend(failed_numbers)
+    elapsed = time.perf_counter() - start
+
+    failed_set = set(failed)
+    enqueued = [number for number in accepted if number not in failed_set]
+    rate = len(enqueued) / elapsed if elapsed > 0 else 0.0
+    logger.info(
+        f"Added {len(enqueued)} numbers to queue in {elapsed:.3f}s "
+        f"({rate:.1f} numbers/s)"
+    )
+
+    body = json.dumps({"accepted": enqueued, "rejected": rejected, "failed": failed})
 
     return_status = create_return_status(200, body)
     logger.info(return_status)
@@ -0,0 +1,458 @@
+import os
+import json
+import time
+import socket
+import logging
+import threading
+import metrics
+
+from urllib.parse import unquote, urlparse
+
+# create logger
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# global variables
+CACHE_URL = os.environ.get("CACHE_URL")  # redis://, rediss:// or memory://
+CACHE_PREFIX = os.environ.get("CACHE_PREFIX", "asetu:")
+CACHE_TIMEOUT_SECONDS = float(os.environ.get("CACHE_TIMEOUT_SECONDS", 0.1))
+CACHE_RETRY_SECONDS = float(os.environ.get("CACHE_RETRY_SECONDS", 30))
+USER_STATUS = "status"
+PENDING_REQUEST = "request"
+
+
+class CacheError(Exception):
+    """Raised when the cache cannot be reached or answers with an error"""
+
+
+class RespConnection:
+    """
+    A connection to a Redis compatible server speaking RESP2
+
+    Attributes
+    ----------
+    url: ParseResult
+        Parsed cache url
+    timeout: float
+        Seconds to wait to connect and for every reply
+    """
+
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+        self._socket = None
+        self._file = None
+
+    def execute(self, *commands):
+        """
+        Send commands in a single round trip and return their replies
+
+        Parameters
+        ----------
+        commands: list
+            Commands as tuples of their arguments
+        """
+
+        if self._socket is None:
+            self._connect()
+
+        try:
+            self._socket.sendall(b"".join(encode_command(c) for c in commands))
+            return [self._read_reply() for _ in commands]
+        except (OSError, ValueError, CacheError):
+            # the connection may be out of step with the server, drop it
+            self.close()
+            raise
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = None
+        self._file = None
+
+    def _connect(self):
+        host = self.url.hostname or "localhost"
+        sock = socket.create_connection((host, self.url.port or 6379), self.timeout)
+        if self.url.scheme == "rediss":
+            import ssl
+
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+        sock.settimeout(self.timeout)
+        self._socket = sock
+        self._file = sock.makefile("rb")
+
+        setup = []
+        if self.url.password:
+            setup.append(("AUTH", unquote(self.url.password)))
+        if self.url.path.strip("/"):
+            setup.append(("SELECT", self.url.path.strip("/")))
+        if setup:
+            self.execute(*setup)
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line.endswith(b"\r\n"):
+            raise CacheError("Connection closed by the cache")
+
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise CacheError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+
+        raise CacheError(f"Unexpected reply {line!r}")
+
+
+def encode_command(arguments):
+    """
+    Encode a command as a RESP array of bulk strings
+
+    Parameters
+    ----------
+    arguments: tuple
+        Command name and arguments
+    """
+
+    parts = [b"*%d\r\n" % len(arguments)]
+    for argument in arguments:
+        if not isinstance(argument, bytes):
+            argument = str(argument).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(argument), argument))
+
+    return b"".join(parts)
+
+
+class RespBackend:
+    """
+    Cache backend for a Redis compatible server. Every thread keeps its own
+    connection, which is opened on first use and reopened after an error.
+
+    Attributes
+    ----------
+    url: ParseResult
+        Parsed cache url
+    timeout: float
+        Seconds to wait to connect and for every reply
+    """
+
+    def __init__(self, url, timeout=CACHE_TIMEOUT_SECONDS):
+        self.url = url
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def get_many(self, keys):
+        return self._execute(("MGET", *keys))[0]
+
+    def set_many(self, entries):
+        self._execute(*(("SET", key, value, "EX", ttl) for key, value, ttl in entries))
+
+    def delete_many(self, keys):
+        self._execute(("DEL", *keys))
+
+    def _execute(self, *commands):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = RespConnection(self.url, self.timeout)
+            self._local.connection = connection
+
+        try:
+            return connection.execute(*commands)
+        except OSError as e:
+            raise CacheError(f"Failed to reach the cache.\n{e}") from e
+
+
+class MemoryBackend:
+    """
+    In process stand-in for a Redis compatible server with the same
+    expiry behaviour, used for local runs and tests
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.time()
+        with self._lock:
+            values = []
+            for key in keys:
+                entry = self._entries.get(key)
+                values.append(entry[1] if entry and entry[0] > now else None)
+            return values
+
+    def set_many(self, entries):
+        now = time.time()
+        with self._lock:
+            for key, value, ttl in entries:
+                self._entries[key] = (now + ttl, value)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class CacheTier:
+    """
+    Optional cache shared by every Lambda instance, read and written through
+    ahead of DynamoDB. Every entry expires at the expiry date of its item.
+    The cache is skipped for CACHE_RETRY_SECONDS after it fails, callers
+    then read from and write to DynamoDB only.
+
+    Attributes
+    ----------
+    backend: RespBackend or MemoryBackend
+        Cache backend, the tier is disabled if it is None
+    hits: int
+        Number of items found in the cache
+    misses: int
+        Number of items not found in the cache
+    errors: int
+        Number of cache calls that failed
+    """
+
+    def __init__(self, backend=None, retry_seconds=CACHE_RETRY_SECONDS):
+        self.backend = backend
+        self.retry_seconds = retry_seconds
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._down_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        """True if the cache is configured and has not failed recently"""
+
+        return self.backend is not None and time.time() >= self._down_until
+
+    def get_many(self, kind, numbers):
+        """
+        Get cached items of mobile numbers. Returns a dict of the items that
+        were found keyed by mobile number.
+
+        Parameters
+        ----------
+        kind: str
+            USER_STATUS or PENDING_REQUEST
+        numbers: list
+            User mobile numbers of the format "+91XXXXXXXXXX"
+        """
+
+        if not numbers or not self.available:
+            return {}
+
+        keys = [create_key(kind, number) for number in numbers]
+        with metrics.span("cache_get"):
+            values = self._call(self.backend.get_many, keys)
+        if values is None:
+            return {}
+
+        items = {}
+        for number, value in zip(numbers, values):
+            if value is not None:
+                item = decode_item(value)
+                if item is not None:
+                    items[number] = item
+
+        with self._lock:
+            self.hits += len(items)
+            self.misses += len(numbers) - len(items)
+        for _ in items:
+            metrics.count("cache_lookups", "CacheResult", "hit")
+        for _ in range(len(numbers) - len(items)):
+            metrics.count("cache_lookups", "CacheResult", "miss")
+
+        return items
+
+    def get(self, kind, number):
+        """
+        Get the cached item of a mobile number or None
+
+        Parameters
+        ----------
+        kind: str
+            USER_STATUS or PENDING_REQUEST
+        number: str
+            User mobile number of the format "+91XXXXXXXXXX"
+        """
+
+        return self.get_many(kind, [number]).get(number)
+
+    def put_many(self, kind, items):
+        """
+        Cache items until their expiry date, items that already expired are
+        skipped
+
+        Parameters
+        ----------
+        kind: str
+            USER_STATUS or PENDING_REQUEST
+        items: list
+            Items holding mobile_number and expdate
+        """
+
+        if not items or not self.available:
+            return
+
+        now = int(time.time())
+        entries = []
+        for item in items:
+            ttl = int(item["expdate"]) - now
+            if ttl > 0:
+                value = json.dumps(item, default=int)
+                entries.append((create_key(kind, item["mobile_number"]), value, ttl))
+
+        if entries:
+            with metrics.span("cache_set"):
+                self._call(self.backend.set_many, entries)
+
+    def put(self, kind, item):
+        """
+        Cache an item until its expiry date
+
+        Parameters
+        ----------
+        kind: str
+            USER_STATUS or PENDING_REQUEST
+        item: dict
+            Item holding mobile_number and expdate
+        """
+
+        self.put_many(kind, [item])
+
+    def delete_many(self, kind, numbers):
+        """
+        Drop cached items of mobile numbers
+
+        Parameters
+        ----------
+        kind: str
+            USER_STATUS or PENDING_REQUEST
+        numbers: list
+            User mobile numbers of the format "+91XXXXXXXXXX"
+        """
+
+        if not numbers or not self.available:
+            return
+
+        keys = [create_key(kind, number) for number in numbers]
+        with metrics.span("cache_set"):
+            self._call(self.backend.delete_many, keys)
+
+    def delete(self, kind, number):
+        """
+        Drop the cached item of a mobile number
+
+        Parameters
+        ----------
+        kind: str
+            USER_STATUS or PENDING_REQUEST
+        number: str
+            User mobile number of the format "+91XXXXXXXXXX"
+        """
+
+        self.delete_many(kind, [number])
+
+    def stats(self):
+        """Cache counters, empty if the cache is not configured"""
+
+        if self.backend is None:
+            return {}
+
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+    def _call(self, function, *args):
+        try:
+            return function(*args)
+        except (CacheError, ValueError) as e:
+            logger.error(f"Cache failed, using DynamoDB only.\n{e}")
+            metrics.count("cache_lookups", "CacheResult", "error")
+            with self._lock:
+                self.errors += 1
+                self._down_until = time.time() + self.retry_seconds
+            return None
+
+
+def decode_item(value):
+    """
+    Decode a cached item. Returns None if the value is not a cached item,
+    which is then read from DynamoDB like any other miss.
+
+    Parameters
+    ----------
+    value: bytes
+        Value read from the cache
+    """
+
+    try:
+        item = json.loads(value)
+    except ValueError as e:
+        logger.error(f"Ignoring malformed cache value.\n{e}")
+        return None
+
+    if not isinstance(item, dict) or "expdate" not in item:
+        logger.error(f"Ignoring malformed cache value {item!r}")
+        return None
+
+    return item
+
+
+def create_key(kind, number):
+    """
+    Create the cache key of an item
+
+    Parameters
+    ----------
+    kind: str
+        USER_STATUS or PENDING_REQUEST
+    number: str
+        User mobile number of the format "+91XXXXXXXXXX"
+    """
+
+    return f"{CACHE_PREFIX}{kind}:{number}"
+
+
+def create_cache_tier(cache_url=CACHE_URL):
+    """
+    Create the cache tier for a cache url, it is disabled if the url is
+    empty
+
+    Parameters
+    ----------
+    cache_url: str
+        redis://[:password@]host[:port][/db], rediss:// for TLS or memory://
+        for the in process stand-in
+    """
+
+    if not cache_url:
+        return CacheTier()
+
+    url = urlparse(cache_url)
+    if url.scheme == "memory":
+        return CacheTier(MemoryBackend())
+    if url.scheme in ("redis", "rediss"):
+        return CacheTier(RespBackend(url))
+
+    logger.error(f"Unsupported CACHE_URL scheme {url.scheme}, cache disabled")
+    return CacheTier()
@@ -0,0 +1,229 @@
+import os
+import time
+import logging
+import threading
+import metrics
+
+from decimal import Decimal
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import BotoCoreError, ClientError
+from clients import dynamodb
+from deadline import MIN_CALL_SECONDS, NO_DEADLINE
+
+# global variables
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+SLOW_CALL_SECONDS = float(os.environ.get("BREAKER_SLOW_CALL_SECONDS", 3))
+OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", 30))
+SYNC_SECONDS = float(os.environ.get("BREAKER_SYNC_SECONDS", 2))
+FAILURE_CODES = (429, 500, 502, 503, 504)
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to an upstream that keeps failing or responding slowly. The
+    breaker opens after FAILURE_THRESHOLD failed or slow calls in a row, then
+    calls are rejected until OPEN_SECONDS have passed. A single trial call is
+    then let through in the half open state, which closes the breaker if it
+    succeeds and opens it again if it fails.
+
+    State is kept across warm invocations. If table_name is set the state is
+    also shared through DynamoDB, so a breaker opened by one container is
+    picked up by the others within SYNC_SECONDS. The shared state is not
+    read or written once the deadline of the caller is too close, the local
+    state decides instead.
+
+    Attributes
+    ----------
+    name: str
+        Breaker name
+    table_name: str
+        Upstream state table name
+    state: str
+        CLOSED, OPEN or HALF_OPEN
+    failures: int
+        Number of failed calls in a row
+    opened_at: float
+        Timestamp the breaker last opened or started a trial call
+    """
+
+    def __init__(self, name, table_name=None):
+        self.name = name
+        self.table_name = table_name
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def key(self):
+        return f"breaker#{self.name}"
+
+    def allow(self, deadline=NO_DEADLINE):
+        """
+        Check if a call may be made. Returns False if it should fail fast.
+
+        Parameters
+        ----------
+        deadline: Deadline
+            Time budget of the invocation
+        """
+
+        now = time.time()
+
+        with self._lock:
+            self._sync(now, deadline)
+
+            if self.state == CLOSED:
+                return True
+
+            # a trial call that never reported back is replaced after a while
+            expired = now - self.opened_at >= OPEN_SECONDS
+            if expired and self._claim_trial(now, deadline):
+                self._transition(HALF_OPEN, now, deadline)
+                return True
+
+        metrics.increment(f"breaker_{self.name}_rejected")
+        metrics.count("breaker_rejections", "Breaker", self.name)
+        return False
+
+    def record(self, success, elapsed=0.0, deadline=NO_DEADLINE):
+        """
+        Record the outcome of a call. Calls slower than SLOW_CALL_SECONDS count
+        as failures.
+
+        Parameters
+        ----------
+        success: bool
+            True if the upstream answered without an error
+        elapsed: float
+            Duration of the call in seconds
+        deadline: Deadline
+            Time budget of the invocation
+        """
+
+        success = success and elapsed < SLOW_CALL_SECONDS
+        now = time.time()
+
+        with self._lock:
+            if success:
+                self.failures = 0
+                if self.state == HALF_OPEN:
+                    self._transition(CLOSED, now, deadline)
+            elif self.state == HALF_OPEN:
+                self._transition(OPEN, now, deadline)
+            elif self.state == CLOSED:
+                self.failures += 1
+                if self.failures >= FAILURE_THRESHOLD:
+                    self._transition(OPEN, now, deadline)
+
+    def _transition(self, state, now, deadline=NO_DEADLINE):
+        """Move to a new state and share it with other containers"""
+
+        logger.info(f"Circuit breaker {self.name} changed from {self.state} to {state}")
+        metrics.increment(f"breaker_{self.name}_{state}")
+        metrics.count(f"breaker_{self.name}_transitions", "State", state)
+
+        self.state = state
+        self.failures = 0
+        if state != CLOSED:
+            self.opened_at = now
+
+        if self._shared(deadline) and state != HALF_OPEN:
+            self._write()
+
+    def _shared(self, deadline):
+        """Check if the shared state is used and there is time to reach it"""
+
+        return bool(self.table_name) and deadline.remaining() >= MIN_CALL_SECONDS
+
+    def _claim_trial(self, now, deadline=NO_DEADLINE):
+        """
+        Claim the trial call so that only one container makes it. Returns
+        False if another container claimed it first. A missing state item,
+        left when opening the breaker could not be written, does not block
+        the claim, the local state decides then.
+        """
+
+        if not self._shared(deadline):
+            return True
+
+        condition = Attr("opened_at").eq(Decimal(str(self.opened_at)))
+        try:
+            self._write(
+                state=HALF_OPEN,
+                opened_at=now,
+                condition=condition | Attr("name").not_exists(),
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                self._synced_at = 0.0  # pick up the new state on the next call
+                return False
+            logger.error(f"Failed to claim trial call of {self.name}.\n{e}")
+        except BotoCoreError as e:
+            logger.error(f"Failed to claim trial call of {self.name}.\n{e}")
+
+        return True
+
+    def _sync(self, now, deadline=NO_DEADLINE):
+        """Read the shared state at most every SYNC_SECONDS"""
+
+        if not self._shared(deadline) or now - self._synced_at < SYNC_SECONDS:
+            return
+        self._synced_at = now
+
+        try:
+            item = (
+                dynamodb()
+                .Table(self.table_name)
+                .get_item(Key={"name": self.key}, ConsistentRead=True)
+                .get("Item")
+            )
+        except (BotoCoreError, ClientError) as e:
+            # carry on with the local state
+            logger.error(f"Failed to read circuit breaker {self.name}.\n{e}")
+            return
+
+        if item is None:
+            return
+
+        state = item["state"]
+        if state != self.state:
+            logger.info(f"Circuit breaker {self.name} is {state} in another container")
+            self.failures = 0
+        self.state = state
+        self.opened_at = float(item["opened_at"])
+
+    def _write(self, state=None, opened_at=None, condition=None):
+        """
+        Write the state to DynamoDB. Raises ClientError only if a condition is
+        given and the write failed.
+        """
+
+        kwargs = {
+            "Item": {
+                "name": self.key,
+                "state": state or self.state,
+                "opened_at": Decimal(str(opened_at or self.opened_at)),
+            }
+        }
+        if condition is not None:
+            kwargs["ConditionExpression"] = condition
+
+        try:
+            dynamodb().Table(self.table_name).put_item(**kwargs)
+        except ClientError as e:
+            if condition is not None:
+                raise
+            logger.error(f"Failed to write circuit breaker {self.name}.\n{e}")
+        except BotoCoreError as e:
+            if condition is not None:
+                raise
+            logger.error(f"Failed to write circuit breaker {self.name}.\n{e}")
@@ -0,0 +1,59 @@
+import os
+import threading
+import boto3
+
+from botocore.config import Config
+
+# global variables
+DYNAMODB_CONNECT_TIMEOUT = float(os.environ.get("DYNAMODB_CONNECT_TIMEOUT", 1))
+DYNAMODB_READ_TIMEOUT = float(os.environ.get("DYNAMODB_READ_TIMEOUT", 1))
+DYNAMODB_MAX_ATTEMPTS = int(os.environ.get("DYNAMODB_MAX_ATTEMPTS", 3))
+
+# DynamoDB answers in milliseconds, a call that hangs is cut short and
+# retried so that all attempts fit well within the 10 second handlers
+DYNAMODB_CONFIG = Config(
+    connect_timeout=DYNAMODB_CONNECT_TIMEOUT,
+    read_timeout=DYNAMODB_READ_TIMEOUT,
+    retries={"mode": "standard", "total_max_attempts": DYNAMODB_MAX_ATTEMPTS},
+)
+
+# boto3 resources are not thread safe, so every thread gets its own
+local = threading.local()
+
+# boto3 clients are thread safe, so they are shared by every thread
+shared_clients = {}
+lock = threading.Lock()
+
+
+def dynamodb():
+    """
+    Get the DynamoDB service resource for the current thread. It is created
+    on first use and reused across warm invocations.
+    """
+
+    if not hasattr(local, "dynamodb"):
+        local.dynamodb = boto3.session.Session().resource(
+            "dynamodb", config=DYNAMODB_CONFIG
+        )
+
+    return local.dynamodb
+
+
+def client(service_name):
+    """
+    Get a boto3 client for a service. It is created on first use, so
+    functions that never call the service do not pay for it on cold start,
+    and reused across warm invocations.
+
+    Parameters
+    ----------
+    service_name: str
+        Name of the AWS service like "sqs"
+    """
+
+    if service_name not in shared_clients:
+        with lock:
+            if service_name not in shared_clients:
+                shared_clients[service_name] = boto3.client(service_name)
+
+    return shared_clients[service_name]
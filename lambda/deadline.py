@@ -0,0 +1,101 @@
+import os
+import math
+import time
+
+# global variables
+DEADLINE_RESERVE_MILLIS = int(os.environ.get("DEADLINE_RESERVE_MILLIS", 300))
+MIN_CALL_SECONDS = 0.1
+MIN_TIMEOUT_SECONDS = 0.01
+
+
+class DeadlineExceeded(Exception):
+    """Raised when there is not enough time left to make a call"""
+
+
+class Deadline:
+    """
+    Time budget of an invocation. It is passed to every DynamoDB and HTTP
+    call, which check it before they start and cap their timeouts at the
+    time that is left.
+
+    Attributes
+    ----------
+    expires_at: float
+        Monotonic clock time the budget runs out
+    """
+
+    def __init__(self, seconds=math.inf):
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_context(cls, context, reserve_millis=DEADLINE_RESERVE_MILLIS):
+        """
+        Create a deadline that runs out reserve_millis before the Lambda
+        function times out, which leaves time to return a response
+
+        Parameters
+        ----------
+        context: LambdaContext
+            context parameters passed to function, no deadline is set if it
+            does not give the remaining time
+        reserve_millis: int
+            Milliseconds kept back to return a response
+        """
+
+        if not hasattr(context, "get_remaining_time_in_millis"):
+            return cls()
+
+        millis = context.get_remaining_time_in_millis() - reserve_millis
+        return cls(max(millis, 0) / 1000)
+
+    def remaining(self):
+        """Seconds left before the deadline"""
+
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def check(self, needed=MIN_CALL_SECONDS):
+        """
+        Raise DeadlineExceeded if less than needed seconds are left
+
+        Parameters
+        ----------
+        needed: float
+            Seconds the next call needs
+        """
+
+        if self.remaining() < needed:
+            raise DeadlineExceeded(f"Less than {needed} seconds left")
+
+    def cap(self, timeout):
+        """
+        Cap a requests timeout at the time that is left
+
+        Parameters
+        ----------
+        timeout: float or tuple
+            Timeout in seconds or tuple of connect and read timeout
+        """
+
+        remaining = max(self.remaining(), MIN_TIMEOUT_SECONDS)
+
+        if isinstance(timeout, tuple):
+            return tuple(min(t, remaining) for t in timeout)
+        return min(timeout, remaining)
+
+    def shorten(self, seconds):
+        """
+        Create a deadline that runs out seconds earlier than this one
+
+        Parameters
+        ----------
+        seconds: float
+            Seconds kept back from this deadline
+        """
+
+        deadline = Deadline()
+        deadline.expires_at = self.expires_at - seconds
+        return deadline
+
+
+# used when a caller sets no deadline
+NO_DEADLINE = Deadline()
@@ -1,15 +1,25 @@
 import json
-import requests
-import jwt
-import boto3
+import asyncio
+import functools
 import os
-import random
-import string
+import sys
 import logging
-import re
+import threading
+import time
+import metrics
 
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
+from cache_tier import PENDING_REQUEST, USER_STATUS, create_cache_tier
+from clients import client, dynamodb
+from deadline import NO_DEADLINE, DeadlineExceeded
+from item_codec import decode_user_status, encode_user_status
+from mobile_number import INVALID_NUMBER, valid_mobile_number
+from rate_limiter import INTERACTIVE
+from token_broker import TokenBroker
 
 # create logger
 logging.basicConfig()
@@ -17,21 +27,28 @@ logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 # global variables
-RANDOM_STR_LEN = 5
 USER_STATUS_EXPIRY_DAYS = 0.9
 PENDING_REQUEST_EXPIRY_HOURS = 0.9
-TOKEN_URL = "https://api.aarogyasetu.gov.in/token"
-USER_STATUS_URL = "https://api.aarogyasetu.gov.in/userstatus"
-USER_STATUS_BY_REQUEST_URL = "https://api.aarogyasetu.gov.in/userstatusbyreqid"
-DATE_TIME_FORMAT = "%Y-%m-%d-%H:%M:%S"
 APPROVED = "Approved"
 PENDING = "Pending"
 WHITE = "0xFFFFFF"
-MOBILE_NUMBER_EXPRESSION = re.compile(r"^\+91\d{10}$")
-
-ssm = boto3.client("ssm")
-ddb = boto3.resource("dynamodb")
-secretsmanager = boto3.client("secretsmanager")
+PENDING_MESSAGE = "Please wait for user to approve request"
+SECRET_TTL_SECONDS = float(os.environ.get("SECRET_TTL_SECONDS", 900))
+SECRET_REFRESH_AHEAD_SECONDS = float(os.environ.get("SECRET_REFRESH_AHEAD_SECONDS", 60))
+STATUS_CONCURRENCY = int(os.environ.get("STATUS_CONCURRENCY", 10))
+REQUEST_LEASE_SECONDS = 10
+REQUEST_LEASE_WAIT_SECONDS = float(os.environ.get("REQUEST_LEASE_WAIT_SECONDS", 3))
+REQUEST_LEASE_POLL_SECONDS = 0.25
+LOOKUP_BATCH_SIZE = 100
+BATCH_GET_NUMBERS = 50  # two keys per number, BatchGetItem reads up to 100 keys
+STATUS_CACHE_SIZE = int(os.environ.get("STATUS_CACHE_SIZE", 1000))
+INVALID_NUMBER_CACHE_SECONDS = int(os.environ.get("INVALID_NUMBER_CACHE_SECONDS", 300))
+BATCH_WRITE_NUMBERS = 12  # two writes per number, BatchWriteItem takes up to 25
+BATCH_ATTEMPTS = 5  # unprocessed items are retried this often at most
+COMMIT_RESERVE_SECONDS = 0.5
+
+# blocking calls made by the status engine run in this pool
+executor = ThreadPoolExecutor(max_workers=STATUS_CONCURRENCY)
 
 
 class EnvVar:
@@ -88,7 +105,9 @@ class Secret:
 
         response = {}
         try:
-            response = secretsmanager.get_secret_value(SecretId=envvar.API_SECRET_ARN)
+            response = client("secretsmanager").get_secret_value(
+                SecretId=envvar.API_SECRET_ARN
+            )
         except ClientError as e:
             logger.error(f"Failed to get secrets from secrets manager.\n{e}")
 
@@ -115,17 +134,237 @@ class Secret:
             raise SystemExit
 
 
+class CredentialProvider:
+    """
+    Keeps environment variables and Aarogya Setu API credentials across warm
+    invocations so that Secrets Manager is only called once every ttl seconds.
+    Credentials are refreshed in the background once they are within
+    refresh_ahead seconds of expiring, and reloaded on the next call after
+    invalidate() so that rotated secrets are picked up.
+
+    Attributes
+    ----------
+    ttl: float
+        Number of seconds credentials are kept before they are reloaded
+    refresh_ahead: float
+        Number of seconds before expiry at which a background refresh starts
+    """
+
+    def __init__(
+        self, ttl=SECRET_TTL_SECONDS, refresh_ahead=SECRET_REFRESH_AHEAD_SECONDS
+    ):
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self._credentials = None
+        self._loaded_at = 0.0
+        # serialises synchronous loads, only held by callers that must wait
+        self._lock = threading.Lock()
+        # held by the one background refresh running at a time
+        self._refresh_lock = threading.Lock()
+        # guards swapping in newly loaded credentials
+        self._swap_lock = threading.Lock()
+
+    @property
+    def invalidated(self):
+        """True if credentials must be reloaded before they are used again"""
+
+        return self._credentials is None
+
+    def get(self):
+        """
+        Return a tuple of EnvVar and Secret. Loads them synchronously if they
+        are missing or expired, and schedules a background refresh if they
+        are about to expire.
+        """
+
+        # work on a copy, invalidate() may drop the credentials at any time
+        loaded, loaded_at = self._current()
+
+        if loaded is None or time.time() - loaded_at >= self.ttl:
+            with self._lock:
+                loaded, loaded_at = self._current()
+                if loaded is None or time.time() - loaded_at >= self.ttl:
+                    loaded = self._load()
+                    self._store(loaded)
+        elif time.time() - loaded_at >= self.ttl - self.refresh_ahead:
+            self._refresh_in_background()
+
+        return loaded
+
+    def invalidate(self):
+        """
+        Drop cached credentials. Called when Aarogya Setu rejects a request
+        because the credentials were rotated.
+        """
+
+        logger.info("Invalidating cached Aarogya Setu credentials")
+        with self._swap_lock:
+            self._credentials = None
+
+    def _load(self):
+        with metrics.span("secrets"):
+            envvar = EnvVar()
+            secret = Secret(envvar)
+        return envvar, secret
+
+    def _current(self):
+        with self._swap_lock:
+            return self._credentials, self._loaded_at
+
+    def _store(self, loaded):
+        with self._swap_lock:
+            self._credentials = loaded
+            self._loaded_at = time.time()
+
+    def _refresh_in_background(self):
+        # callers never wait on a refresh that is already running
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+
+        try:
+            thread = threading.Thread(target=self._background_refresh, daemon=True)
+            thread.start()
+        except RuntimeError:
+            self._refresh_lock.release()
+            raise
+
+    def _background_refresh(self):
+        try:
+            # loaded without holding a lock, callers keep using the current
+            # credentials until the new ones are swapped in
+            self._store(self._load())
+        except (Exception, SystemExit) as e:
+            # keep serving the current credentials until they expire
+            logger.error(f"Failed to refresh credentials in background.\n{e}")
+        finally:
+            self._refresh_lock.release()
+
+
+# credentials shared across warm invocations
+credentials = CredentialProvider()
+
+
+class StatusCache:
+    """
+    A bounded least recently used cache of approved user statuses kept
+    across warm invocations. Every entry expires at the expiry date of its
+    item. Mobile numbers Aarogya Setu rejected are cached as negative
+    entries for INVALID_NUMBER_CACHE_SECONDS.
+
+    Attributes
+    ----------
+    max_size: int
+        Maximum number of entries kept in the cache
+    hits: int
+        Number of lookups answered from the cache
+    misses: int
+        Number of lookups not found in the cache
+    evictions: int
+        Number of entries dropped because the cache was full
+    """
+
+    def __init__(self, max_size=STATUS_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, number):
+        """
+        Get a cached user status item, INVALID_NUMBER for a negative entry or
+        None if the number is not cached
+
+        Parameters
+        ----------
+        number: str
+            User mobile number of the format "+91XXXXXXXXXX"
+        """
+
+        with self._lock:
+            cached = self._entries.get(number)
+
+            if cached is not None and cached[0] <= time.time():
+                del self._entries[number]
+                cached = None
+
+            if cached is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(number)
+            self.hits += 1
+            return cached[1]
+
+    def put(self, number, item):
+        """
+        Cache an approved user status item until its expiry date
+
+        Parameters
+        ----------
+        number: str
+            User mobile number of the format "+91XXXXXXXXXX"
+        item: dict
+            Item from user status table
+        """
+
+        self._put(number, int(item["expdate"]), item)
+
+    def put_invalid(self, number):
+        """
+        Cache a negative entry for a mobile number Aarogya Setu rejected
+
+        Parameters
+        ----------
+        number: str
+            User mobile number of the format "+91XXXXXXXXXX"
+        """
+
+        self._put(number, time.time() + INVALID_NUMBER_CACHE_SECONDS, INVALID_NUMBER)
+
+    def stats(self):
+        """Cache counters"""
+
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _put(self, number, expdate, value):
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[number] = (expdate, value)
+            self._entries.move_to_end(number)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+# approved statuses are cached across warm invocations
+status_cache = StatusCache()
+
+# statuses and pending requests shared by every instance if CACHE_URL is set
+cache_tier = create_cache_tier()
+
+
 def expired(expdate):
     """
-    Checks if the expiry date field from a record is past
+    Checks if the expiry date field from a record is past. Items written
+    before expdate became a number hold it as a string.
 
     Parameters
     ----------
-    expdata: str
+    expdate: int
         Expiry date timestamp
     """
 
-    return expdate < str(int(datetime.now().timestamp()))
+    return int(expdate) < int(datetime.now().timestamp())
 
 
 def create_return_header():
@@ -183,53 +422,38 @@ def create_return_response(status_code, body):
     return {"headers": headers, "statusCode": status_code, "body": body}
 
 
-def create_request_header(secret, token=None):
+def create_user_status_item(number, status, request_status):
     """
-    Create header for API request to Aarogya Setu. There can be two types
-    of headers one with token and one without it.
+    Create a user status table item with an expiration time stamp. Items
+    are stored in the compact form given by encode_user_status.
 
     Parameters
     ----------
-    envvar: Secret
-        object contains api secrets
-    token: str
-        Request token given returned as reponse from TOKEN_URL
-    """
-
-    if token is None:
-        return {
-            "accept": "application/json",
-            "x-api-key": secret.API_KEY,
-            "Content-Type": "application/json",
-        }
-    else:
-        return {
-            "accept": "application/json",
-            "x-api-key": secret.API_KEY,
-            "Content-Type": "application/json",
-            "Authorization": token,
-        }
-
-
-def create_trace_id():
-    """
-    Create a unique trace_id by combining current timestamp and some random
-    ascii uppercase text.
+    number: str
+        User mobile number of the format "+91XXXXXXXXXX"
+    status: dict
+        Status returned by Aarogya Setu API
+    request_status: str
+        Request status is either Approved or Rejected
     """
 
-    timestamp = datetime.today().strftime(DATE_TIME_FORMAT)
-    randomstr = "".join(
-        random.choices(string.ascii_uppercase + string.digits, k=RANDOM_STR_LEN)
-    )
-    trace_id = timestamp + "-" + randomstr
-
-    return trace_id
+    expdate = datetime.now() + timedelta(days=USER_STATUS_EXPIRY_DAYS)
+    expdate = int(expdate.timestamp())
+
+    return {
+        "mobile_number": number,
+        "message": status["message"],
+        "colour": status["color_code"],
+        "expdate": expdate,
+        "request_status": request_status,
+    }
 
 
-def store_user_status(number, status, request_status, envvar):
+def commit_user_status(number, status, request_status, envvar, deadline=NO_DEADLINE):
     """
-    Takes a status response adds an expiration time stamp to it and
-    stores it in user status table.
+    Store a resolved user status and delete its pending request in a single
+    transaction, so a pending request is never left behind once its status
+    is stored.
 
     Parameters
     ----------
@@ -241,30 +465,104 @@ def store_user_status(number, status, request_status, envvar):
         Request status is either Approved or Rejected
     envvar: EnvVar
         Object contains environment variables
+    deadline: Deadline
+        Time budget of the invocation
     """
 
-    expdate = datetime.now() + timedelta(days=USER_STATUS_EXPIRY_DAYS)
-    expdate = str(int(expdate.timestamp()))
-    user_status_table = ddb.Table(envvar.USER_STATUS_TABLE)
+    item = create_user_status_item(number, status, request_status)
+    deadline.check()
 
+    # the resource client serializes python values like the table resource
     try:
-        user_status_table.put_item(
-            Item={
-                "mobile_number": number,
-                "message": status["message"],
-                "colour": status["color_code"],
-                "expdate": expdate,
-                "request_status": request_status,
-            },
+        dynamodb().meta.client.transact_write_items(
+            TransactItems=[
+                {
+                    "Put": {
+                        "TableName": envvar.USER_STATUS_TABLE,
+                        "Item": encode_user_status(item),
+                    }
+                },
+                {
+                    "Delete": {
+                        "TableName": envvar.REQUESTS_TABLE,
+                        "Key": {"mobile_number": number},
+                    }
+                },
+            ]
         )
     except ClientError as e:
-        logger.error(f"Failed to store user status\n{e}")
+        logger.error(f"Failed to commit user status.\n{e}")
+    else:
+        cache_tier.put(USER_STATUS, item)
+        cache_tier.delete(PENDING_REQUEST, number)
+
+
+def commit_user_statuses(resolutions, envvar, deadline=NO_DEADLINE):
+    """
+    Store resolved user statuses and delete their pending requests with
+    BatchWriteItem. Used by the status engine to commit many numbers in a
+    few round trips. Unlike commit_user_status the writes are not atomic.
+    Writes still unprocessed after BATCH_ATTEMPTS are given up, the pending
+    requests left behind are resolved again by the next run.
+
+    Parameters
+    ----------
+    resolutions: list
+        Tuples of mobile number, status and request status
+    envvar: EnvVar
+        Object contains environment variables
+    deadline: Deadline
+        Time budget of the invocation
+    """
+
+    for first in range(0, len(resolutions), BATCH_WRITE_NUMBERS):
+        last = first + BATCH_WRITE_NUMBERS
+        batch = resolutions[first:last]
+        items = [create_user_status_item(*resolution) for resolution in batch]
+        request_items = {
+            envvar.USER_STATUS_TABLE: [
+                {"PutRequest": {"Item": encode_user_status(item)}} for item in items
+            ],
+            envvar.REQUESTS_TABLE: [
+                {"DeleteRequest": {"Key": {"mobile_number": resolution[0]}}}
+                for resolution in batch
+            ],
+        }
+
+        attempt = 0
+        while request_items:
+            if attempt == BATCH_ATTEMPTS:
+                logger.error(f"Gave up committing {len(batch)} user statuses")
+                break
+
+            deadline.check()
+            try:
+                response = dynamodb().batch_write_item(RequestItems=request_items)
+            except ClientError as e:
+                logger.error(f"Failed to commit user statuses.\n{e}")
+                break
+
+            # retry writes that were throttled with a short backoff
+            request_items = response.get("UnprocessedItems")
+            if request_items:
+                time.sleep(min(0.05 * 2**attempt, 1))
+                attempt += 1
+
+        # only write through batches that were written in full
+        if not request_items:
+            cache_tier.put_many(USER_STATUS, items)
+            cache_tier.delete_many(
+                PENDING_REQUEST, [item["mobile_number"] for item in items]
+            )
 
 
-def store_pending_request(number, token, request_id, envvar):
+def store_pending_request(
+    number, token, request_id, envvar, token_expdate=None, deadline=NO_DEADLINE
+):
     """
     Store pending request identified by the tuple of mobile number, API token,
-    and unique request id. The record has an expiry duration.
+    and unique request id. The record has an expiry duration, which is cut
+    short if the token expires before it.
 
     Parameters
     ----------
@@ -276,33 +574,40 @@ def store_pending_request(number, token, request_id, envvar):
         Request id returned by response from USER_STATUS_URL
     envvar: EnvVar
         Object contains environment variables
+    token_expdate: int
+        Expiry date timestamp of the token
+    deadline: Deadline
+        Time budget of the invocation
     """
 
     expdate = datetime.now() + timedelta(hours=PENDING_REQUEST_EXPIRY_HOURS)
-    expdate = str(int(expdate.timestamp()))
-    requests_table = ddb.Table(envvar.REQUESTS_TABLE)
+    expdate = int(expdate.timestamp())
+    if token_expdate is not None:
+        expdate = min(expdate, token_expdate)
+    requests_table = dynamodb().Table(envvar.REQUESTS_TABLE)
+    item = {
+        "mobile_number": number,
+        "token": token,
+        "request_id": request_id,
+        "expdate": expdate,
+    }
 
+    deadline.check()
     try:
-        requests_table.put_item(
-            Item={
-                "mobile_number": number,
-                "token": token,
-                "request_id": request_id,
-                "expdate": expdate,
-            },
-        )
+        requests_table.put_item(Item=item)
     except ClientError as e:
         logger.error(f"Failed to store pending request.\n{e}")
+    else:
+        cache_tier.put(PENDING_REQUEST, item)
 
 
-def delete_pending_request(number, envvar):
+def acquire_request_lease(number, envvar, deadline=NO_DEADLINE):
     """
-    Delete pending request after it has been used to successfully get user
-    status.
-
-    Note: If a request_id has been used to successfully get user status it
-    should be deleted because it cannot be used to make status requests
-    anymore.
+    Acquire the right to create a new request for a mobile number. A lease
+    item is put in the pending requests table with a conditional write that
+    only succeeds if there is no unexpired pending request or lease, so only
+    one invocation creates a request for a number at a time. Returns False
+    if another invocation holds the lease.
 
     Parameters
     ----------
@@ -310,19 +615,39 @@ def delete_pending_request(number, envvar):
         User mobile number of the format "+91XXXXXXXXXX"
     envvar: EnvVar
         Object contains environment variables
+    deadline: Deadline
+        Time budget of the invocation
     """
 
-    requests_table = ddb.Table(envvar.REQUESTS_TABLE)
+    now = int(datetime.now().timestamp())
+    requests_table = dynamodb().Table(envvar.REQUESTS_TABLE)
 
+    deadline.check()
     try:
-        requests_table.delete_item(Key={"mobile_number": number})
+        requests_table.put_item(
+            Item={
+                "mobile_number": number,
+                "expdate": now + REQUEST_LEASE_SECONDS,
+            },
+            # a string expdate was written before the migration to numbers
+            ConditionExpression=Attr("mobile_number").not_exists()
+            | Attr("expdate").lt(now)
+            | Attr("expdate").attribute_type("S"),
+        )
     except ClientError as e:
-        logger.error(f"Failed to delete pending request.\n{e}")
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+
+        # carry on without the lease rather than failing the request
+        logger.error(f"Failed to acquire request lease.\n{e}")
+
+    return True
 
 
-def get_pending_request(number, envvar):
+def release_request_lease(number, envvar, deadline=NO_DEADLINE):
     """
-    Get pending request from table. If it has expired return None
+    Release a lease that did not lead to a pending request, so that the
+    next invocation can try to create the request straight away
 
     Parameters
     ----------
@@ -330,25 +655,27 @@ def get_pending_request(number, envvar):
         User mobile number of the format "+91XXXXXXXXXX"
     envvar: EnvVar
         Object contains environment variables
+    deadline: Deadline
+        Time budget of the invocation
     """
 
-    requests_table = ddb.Table(envvar.REQUESTS_TABLE)
+    requests_table = dynamodb().Table(envvar.REQUESTS_TABLE)
 
+    deadline.check()
     try:
-        item = requests_table.get_item(Key={"mobile_number": number}).get("Item")
+        requests_table.delete_item(
+            Key={"mobile_number": number},
+            ConditionExpression=Attr("request_id").not_exists(),
+        )
     except ClientError as e:
-        logger.error(f"Failed to get pending request from table.\n{e}")
-        return None
-
-    if item and not expired(item["expdate"]):
-        return item
-    else:
-        return None
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            logger.error(f"Failed to release request lease.\n{e}")
 
 
-def check_user_status(number, envvar):
+def get_pending_request(number, envvar, deadline=NO_DEADLINE):
     """
-    Get user status from table. If it has expired return None
+    Get pending request from the cache tier or the table. If it has expired
+    return None
 
     Parameters
     ----------
@@ -356,125 +683,186 @@ def check_user_status(number, envvar):
         User mobile number of the format "+91XXXXXXXXXX"
     envvar: EnvVar
         Object contains environment variables
+    deadline: Deadline
+        Time budget of the invocation
     """
 
-    user_status_table = ddb.Table(envvar.USER_STATUS_TABLE)
+    item = cache_tier.get(PENDING_REQUEST, number)
+    if item and not expired(item["expdate"]):
+        return item
 
+    requests_table = dynamodb().Table(envvar.REQUESTS_TABLE)
+
+    deadline.check()
     try:
-        item = user_status_table.get_item(Key={"mobile_number": number}).get("Item")
+        item = requests_table.get_item(Key={"mobile_number": number}).get("Item")
     except ClientError as e:
-        logger.error(f"Failed to get existing user status.\n{e}")
+        logger.error(f"Failed to get pending request from table.\n{e}")
         return None
 
     if item and not expired(item["expdate"]):
+        # leases are short lived and replaced by the request, never cache them
+        if "request_id" in item:
+            cache_tier.put(PENDING_REQUEST, item)
         return item
     else:
         return None
 
 
-def get_token(secret):
+def lookup_mobile_numbers(numbers, envvar, deadline=NO_DEADLINE):
     """
-    Get API token from Aarogya Setu it is valid for one hour and one succesful
-    status request
+    Get cached user status and pending request of mobile numbers from both
+    tables with BatchGetItem. Up to BATCH_GET_NUMBERS numbers are read in
+    a single round trip, numbers with an approved status in the cache tier
+    are not read at all. Returns a dict that maps every number to a tuple
+    of user status and pending request, either of which is None if it does
+    not exist or has expired, or could not be read within BATCH_ATTEMPTS.
 
     Parameters
     ----------
-    envvar: Secret
-        Object contains secrets
+    numbers: list
+        User mobile numbers of the format "+91XXXXXXXXXX"
+    envvar: EnvVar
+        Object contains environment variables
+    deadline: Deadline
+        Time budget of the invocation
     """
 
-    url = TOKEN_URL
-    headers = create_request_header(secret)
-    body = {"username": secret.USERNAME, "password": secret.PASSWORD}
-
-    res = requests.post(url, data=json.dumps(body), headers=headers)
-    if res.status_code != requests.codes.ok:
-        logger.error(f"Aarogya Setu API failed to get token.\n{res.content}")
-        return None
-    else:
-        return res.json()["token"]
-
+    lookups = {number: (None, None) for number in numbers}
+    user_statuses = {}
+    pending_requests = {}
+
+    # numbers with an approved status in the cache tier need no pending request
+    for number, item in cache_tier.get_many(USER_STATUS, list(lookups)).items():
+        if item["request_status"] == APPROVED and not expired(item["expdate"]):
+            user_statuses[number] = item
+    unique_numbers = [number for number in lookups if number not in user_statuses]
+    read_user_statuses = []
+
+    for first in range(0, len(unique_numbers), BATCH_GET_NUMBERS):
+        last = first + BATCH_GET_NUMBERS
+        keys = [{"mobile_number": number} for number in unique_numbers[first:last]]
+        request_items = {
+            envvar.USER_STATUS_TABLE: {"Keys": keys},
+            envvar.REQUESTS_TABLE: {"Keys": keys},
+        }
 
-def create_new_request(number, token, secret):
+        attempt = 0
+        while request_items:
+            if attempt == BATCH_ATTEMPTS:
+                logger.error(f"Gave up reading {len(keys)} mobile numbers")
+                break
+
+            deadline.check()
+            try:
+                response = dynamodb().batch_get_item(RequestItems=request_items)
+            except ClientError as e:
+                logger.error(f"Failed to get user statuses and pending requests.\n{e}")
+                break
+
+            for item in response["Responses"].get(envvar.USER_STATUS_TABLE, []):
+                user_statuses[item["mobile_number"]] = decode_user_status(item)
+                read_user_statuses.append(item)
+            for item in response["Responses"].get(envvar.REQUESTS_TABLE, []):
+                pending_requests[item["mobile_number"]] = item
+
+            # retry keys that were throttled with a short backoff
+            request_items = response.get("UnprocessedKeys")
+            if request_items:
+                time.sleep(min(0.05 * 2**attempt, 1))
+                attempt += 1
+
+    # pending requests are only read from the cache tier while waiting on
+    # another invocation's lease, so they are not written back here
+    cache_tier.put_many(USER_STATUS, read_user_statuses)
+
+    for number in lookups:
+        entries = []
+        for entry in (user_statuses.get(number), pending_requests.get(number)):
+            if entry and not expired(entry["expdate"]):
+                entries.append(entry)
+            else:
+                entries.append(None)
+        lookups[number] = tuple(entries)
+
+    return lookups
+
+
+def mint_token(priority=INTERACTIVE, deadline=NO_DEADLINE):
     """
-    Create a new request with Aarogya Setu. Store both token and request id
-    in the pending requests table.
+    Get a new API token from Aarogya Setu using the cached credentials. The
+    request is retried once if the credentials were rotated.
 
     Parameters
     ----------
-    number: str
-        User mobile number of the format "+91XXXXXXXXXX"
-    token: str
-        Request token given returned as reponse from TOKEN_URL
-    secret: Secret
-        Object contains secrets
+    priority: str
+        INTERACTIVE for gate checks or BULK for background work
+    deadline: Deadline
+        Time budget of the invocation
     """
 
-    url = USER_STATUS_URL
-    trace_id = create_trace_id()
+    from upstream import get_token
 
-    headers = create_request_header(secret, token)
-    body = {
-        "phone_number": number,
-        "trace_id": trace_id,
-        "reason": "Office entry",
-    }
+    envvar, secret = credentials.get()
+    with metrics.span("mint"):
+        token = get_token(secret, priority, deadline, credentials)
 
-    res = requests.post(url, data=json.dumps(body), headers=headers)
-    if res.status_code != requests.codes.ok:
-        logger.error(f"Aarogya Setu API failed to get request id.\n{res.content}")
-        return None
-    else:
-        return res.json()["requestId"]
+    # retry once if the credentials were rotated
+    if token is None and credentials.invalidated:
+        envvar, secret = credentials.get()
+        with metrics.span("mint"):
+            token = get_token(secret, priority, deadline, credentials)
+
+    return token
 
 
-def get_status_content(number, token, request_id, secret):
+# token broker shared across warm invocations
+token_broker = TokenBroker(os.environ.get("TOKEN_POOL_TABLE"), mint_token)
+
+
+def decode_status(content, secret):
     """
-    Get status for a pending request. Delete entry from pending request table
-    if successfully gets status
+    Decode user status using the jwt secret token and return an appropriate
+    return status
 
     Parameters
     ----------
-    number: str
-        User mobile number of the format "+91XXXXXXXXXX"
-    token: str
-        Request token given returned as reponse from TOKEN_URL
+    content: dict
+        Encoded status returned as reponse from USER_STATUS_BY_REQUEST_URL
     secret: Secret
         Object contains secrets
     """
 
-    url = USER_STATUS_BY_REQUEST_URL
-    headers = create_request_header(secret, token)
-    body = {"requestId": request_id}
+    import jwt
 
-    res = requests.post(url, data=json.dumps(body), headers=headers)
-    if res.status_code != requests.codes.ok:
-        logger.error(
-            f"Aarogya Setu API failed to get status for given request.\n{res.content}"
-        )
-        return None
-    else:
-        return res.json()
+    coded_status = content["as_status"]
+    status = jwt.decode(coded_status, secret.JWT_SECRET, algorithms=["HS256"])
+    logger.info(status)
 
+    return status["as_status"]
 
-def decode_status(content, secret):
+
+def status_from_content(content, secret):
     """
-    Decode user status using the jwt secret token and return an appropriate
-    return status
+    Get user status from a status response. Approved statuses are decoded,
+    every other request status gets a default status.
 
     Parameters
     ----------
     content: dict
-        Encoded status returned as reponse from USER_STATUS_BY_REQUEST_URL
+        Status returned as reponse from USER_STATUS_BY_REQUEST_URL
     secret: Secret
         Object contains secrets
     """
 
-    coded_status = content["as_status"]
-    status = jwt.decode(coded_status, secret.JWT_SECRET)
-    logger.info(status)
+    if content["request_status"] == APPROVED:
+        return decode_status(content, secret)
 
-    return status["as_status"]
+    # default status
+    return {
+        "message": "User as rejected request. Please create a new request",
+        "color_code": WHITE,
+    }
 
 
 def create_reponse_from_status(number, status, request_status):
@@ -495,7 +883,7 @@ def create_reponse_from_status(number, status, request_status):
         message = create_return_body(number, status["message"], status["color_code"])
         return_response = create_return_response(200, message)
     elif request_status == PENDING:
-        message = create_return_body(number, "Please wait for user to approve request")
+        message = create_return_body(number, PENDING_MESSAGE)
         return_response = create_return_response(200, message)
     else:
         message = create_return_body(
@@ -506,20 +894,140 @@ def create_reponse_from_status(number, status, request_status):
     return return_response
 
 
-def valid_mobile_number(number):
+def create_retry_response(number):
+    """
+    Create return response for a mobile number that could not be checked
+    before the deadline. The 503 status code tells callers to retry.
+
+    Parameters
+    ----------
+    number: str
+        User mobile number of the format "+91XXXXXXXXXX"
+    """
+
+    message = create_return_body(number, "Status check is pending. Please try again")
+    return create_return_response(503, message)
+
+
+async def run_blocking(function, *args):
+    """
+    Run a blocking function in the shared thread pool so that other mobile
+    numbers can make progress while it waits on DynamoDB or Aarogya Setu
+
+    Parameters
+    ----------
+    function: callable
+        Blocking function to run
+    args: list
+        Positional arguments passed to function
+    """
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args))
+
+
+async def prefetch_lookups(numbers, semaphore, deadline=NO_DEADLINE):
+    """
+    Look up the cached user status and pending request of every valid
+    mobile number. Numbers found in the status cache are not read from
+    DynamoDB, the others are read in batches of LOOKUP_BATCH_SIZE
+
+    Parameters
+    ----------
+    numbers: list
+        User mobile numbers of the format "+91XXXXXXXXXX"
+    semaphore: asyncio.Semaphore
+        Bounds the number of batches read at the same time
+    deadline: Deadline
+        Time budget of the invocation
+    """
+
+    valid_numbers = [n for n in numbers if n and valid_mobile_number(n)]
+    valid_numbers = list(dict.fromkeys(valid_numbers))
+
+    lookups = {}
+    missed_numbers = []
+    for number in valid_numbers:
+        cached = status_cache.get(number)
+        if cached is None:
+            missed_numbers.append(number)
+            continue
+
+        metrics.count("checks", "CacheOutcome", "memory")
+        if cached is INVALID_NUMBER:
+            lookups[number] = INVALID_NUMBER
+        else:
+            lookups[number] = (cached, None)
+
+    if not missed_numbers:
+        return lookups
+
+    envvar, secret = await run_blocking(credentials.get)
+
+    batches = []
+    for first in range(0, len(missed_numbers), LOOKUP_BATCH_SIZE):
+        last = first + LOOKUP_BATCH_SIZE
+        batches.append(missed_numbers[first:last])
+
+    async def lookup(batch):
+        async with semaphore:
+            return await run_blocking(lookup_mobile_numbers, batch, envvar, deadline)
+
+    with metrics.span("lookup"):
+        for found in await asyncio.gather(*(lookup(batch) for batch in batches)):
+            lookups.update(found)
+
+    # keep approved statuses in memory for the next lookups
+    for number in missed_numbers:
+        entry = lookups[number][0]
+        if entry is not None and entry["request_status"] == APPROVED:
+            metrics.count("checks", "CacheOutcome", "table")
+            status_cache.put(number, entry)
+        elif lookups[number][1] is not None:
+            metrics.count("checks", "CacheOutcome", "pending")
+        else:
+            metrics.count("checks", "CacheOutcome", "miss")
+
+    return lookups
+
+
+async def wait_for_pending_request(number, envvar, deadline=NO_DEADLINE):
     """
-    Check if the mobile number is valid
+    Wait for the invocation holding the request lease of a mobile number to
+    store its pending request. Returns the pending request or None if it was
+    not stored within REQUEST_LEASE_WAIT_SECONDS, or raises DeadlineExceeded
+    if the deadline is up first.
 
     Parameters
     ----------
     number: str
         User mobile number of the format "+91XXXXXXXXXX"
+    envvar: EnvVar
+        Object contains environment variables
+    deadline: Deadline
+        Time budget of the invocation
     """
 
-    return MOBILE_NUMBER_EXPRESSION.match(number)
+    wait_seconds = min(REQUEST_LEASE_WAIT_SECONDS, deadline.remaining())
+    wait_until = time.time() + wait_seconds
+
+    while time.time() < wait_until:
+        await asyncio.sleep(REQUEST_LEASE_POLL_SECONDS)
+        entry = await run_blocking(get_pending_request, number, envvar, deadline)
+
+        if entry is not None and "request_id" in entry:
+            metrics.increment("coalesced_requests")
+            metrics.count("pending_requests", "RequestSource", "coalesced")
+            logger.info(f"Reusing request {entry['request_id']} for {number}")
+            return entry
+
+    deadline.check()
+    return None
 
 
-def check_mobile_number(number):
+async def resolve_mobile_number(
+    number, semaphore, lookups, commits=None, priority=INTERACTIVE, deadline=NO_DEADLINE
+):
     """
     Check mobile number for COVID status. It first checks user status table
     for cached entry. If the entry is expired it makes a fresh request and then
@@ -529,6 +1037,17 @@ def check_mobile_number(number):
     ----------
     number: str
         User mobile number of the format "+91XXXXXXXXXX"
+    semaphore: asyncio.Semaphore
+        Bounds the number of mobile numbers resolved at the same time
+    lookups: dict
+        Cached user status and pending request keyed by mobile number
+    commits: list
+        Collects resolved statuses to commit in bulk, they are committed
+        right away if it is None
+    priority: str
+        INTERACTIVE for gate checks or BULK for background work
+    deadline: Deadline
+        Time budget of the invocation
     """
 
     # reject empty or invalid mobile numbers
@@ -536,44 +1055,133 @@ def check_mobile_number(number):
         message = create_return_body(number, "Mobile number is invalid")
         return create_return_response(200, message)
 
-    envvar = EnvVar()
-    secret = Secret(envvar)
+    # reject mobile numbers Aarogya Setu recently rejected
+    if lookups[number] is INVALID_NUMBER:
+        message = create_return_body(number, "Mobile number is invalid")
+        return create_return_response(200, message)
+
+    async with semaphore:
+        try:
+            return await resolve_valid_mobile_number(
+                number, lookups[number], commits, priority, deadline
+            )
+        except DeadlineExceeded as e:
+            logger.info(f"Stopped checking {number} early.\n{e}")
+            return create_retry_response(number)
+
+
+async def resolve_valid_mobile_number(
+    number, lookup, commits=None, priority=INTERACTIVE, deadline=NO_DEADLINE
+):
+    """
+    Resolve the status of a valid mobile number
+
+    Parameters
+    ----------
+    number: str
+        User mobile number of the format "+91XXXXXXXXXX"
+    lookup: tuple
+        Cached user status and pending request of the number
+    commits: list
+        Collects resolved statuses to commit in bulk, they are committed
+        right away if it is None
+    priority: str
+        INTERACTIVE for gate checks or BULK for background work
+    deadline: Deadline
+        Time budget of the invocation
+    """
 
-    # check if status exists in ddb
-    entry = check_user_status(number, envvar)
+    # status and pending request were read from ddb in a single batch
+    entry, pending_entry = lookup
 
     # returned cached entry if it exists and status is not pending or denied
     if entry is not None and entry["request_status"] == APPROVED:
         message = create_return_body(number, entry["message"], entry["colour"])
         return create_return_response(200, message)
 
-    # check ddb for pending request
-    entry = get_pending_request(number, envvar)
+    # credentials are only needed once the number is not cached as approved
+    envvar, secret = await run_blocking(credentials.get)
+    entry = pending_entry
+
+    # the http client is only imported once Aarogya Setu has to be called
+    from upstream import create_new_request, get_status_content
+
+    # only one invocation creates a request, the others reuse its request id
+    with metrics.span("request_lease"):
+        if entry is None:
+            if not await run_blocking(acquire_request_lease, number, envvar, deadline):
+                entry = {}
+
+        if entry is not None and "request_id" not in entry:
+            entry = await wait_for_pending_request(number, envvar, deadline)
+
+            if entry is None:
+                return create_reponse_from_status(number, None, PENDING)
 
     # create new request if it doesn't exist
     if entry is None:
-        token = get_token(secret)
+        with metrics.span("token"):
+            leased = await run_blocking(token_broker.lease, priority, deadline)
 
-        if token is None:
+        if leased is None:
+            await run_blocking(release_request_lease, number, envvar, deadline)
             message = create_return_body(
                 number, "Failed to get token from Aarogya Setu. Please try again"
             )
             return create_return_response(502, message)
 
-        request_id = create_new_request(number, token, secret)
+        token, token_expdate = leased
+
+        with metrics.span("create_request"):
+            request_id = await run_blocking(
+                create_new_request,
+                number,
+                token,
+                secret,
+                priority,
+                deadline,
+                credentials,
+            )
+
+        # remember numbers Aarogya Setu rejected so they are not sent again
+        if request_id is INVALID_NUMBER:
+            status_cache.put_invalid(number)
+            await run_blocking(release_request_lease, number, envvar, deadline)
+            message = create_return_body(number, "Mobile number is invalid")
+            return create_return_response(200, message)
 
         if request_id is None:
+            await run_blocking(release_request_lease, number, envvar, deadline)
             message = create_return_body(
                 number, "Failed to get request id from Aarogya Setu. Please try again"
             )
             return create_return_response(502, message)
 
-        store_pending_request(number, token, request_id, envvar)
+        metrics.count("pending_requests", "RequestSource", "created")
+        await run_blocking(
+            store_pending_request,
+            number,
+            token,
+            request_id,
+            envvar,
+            token_expdate,
+            deadline,
+        )
     else:
         token = entry["token"]
         request_id = entry["request_id"]
 
-    content = get_status_content(number, token, request_id, secret)
+    with metrics.span("status_poll"):
+        content = await run_blocking(
+            get_status_content,
+            number,
+            token,
+            request_id,
+            secret,
+            priority,
+            deadline,
+            credentials,
+        )
 
     if content is None:
         message = create_return_body(
@@ -581,20 +1189,20 @@ def check_mobile_number(number):
         )
         return create_return_response(502, message)
 
-    # default status
-    status = {
-        "message": "User as rejected request. Please create a new request",
-        "color_code": WHITE,
-    }
+    with metrics.span("decode"):
+        status = status_from_content(content, secret)
 
     # store rejected and approved statuses
     if content["request_status"] != PENDING:
-
+        resolution = (number, status, content["request_status"])
         if content["request_status"] == APPROVED:
-            status = decode_status(content, secret)
+            status_cache.put(number, create_user_status_item(*resolution))
 
-        store_user_status(number, status, content["request_status"], envvar)
-        delete_pending_request(number, envvar)
+        if commits is None:
+            with metrics.span("commit"):
+                await run_blocking(commit_user_status, *resolution, envvar, deadline)
+        else:
+            commits.append(resolution)
 
     return_response = create_reponse_from_status(
         number, status, content["request_status"]
@@ -602,3 +1210,131 @@ def check_mobile_number(number):
     logger.info(return_response)
 
     return return_response
+
+
+async def check_mobile_numbers_async(
+    numbers,
+    concurrency=STATUS_CONCURRENCY,
+    return_exceptions=False,
+    priority=INTERACTIVE,
+    deadline=NO_DEADLINE,
+):
+    """
+    Check a list of mobile numbers for COVID status concurrently. Returns
+    a list of return responses in the same order as numbers.
+
+    Parameters
+    ----------
+    numbers: list
+        User mobile numbers of the format "+91XXXXXXXXXX"
+    concurrency: int
+        Maximum number of mobile numbers resolved at the same time
+    return_exceptions: bool
+        Return the exception raised for a number in place of its response
+        instead of raising it
+    priority: str
+        INTERACTIVE for gate checks or BULK for background work
+    deadline: Deadline
+        Time budget of the invocation
+    """
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # a single number is committed in a transaction, many in batches
+    commits = [] if len(numbers) > 1 else None
+
+    # keep time back to commit the batch once the numbers are resolved
+    work_deadline = deadline
+    if commits is not None:
+        work_deadline = deadline.shorten(COMMIT_RESERVE_SECONDS)
+
+    try:
+        lookups = await prefetch_lookups(numbers, semaphore, work_deadline)
+    except DeadlineExceeded as e:
+        logger.info(f"Stopped checking mobile numbers early.\n{e}")
+        return [create_retry_response(number) for number in numbers]
+
+    return_responses = await asyncio.gather(
+        *(
+            resolve_mobile_number(
+                number, semaphore, lookups, commits, priority, work_deadline
+            )
+            for number in numbers
+        ),
+        return_exceptions=return_exceptions,
+    )
+
+    if commits:
+        # a number listed twice must only be written once per batch
+        resolutions = {resolution[0]: resolution for resolution in commits}
+        resolutions = list(resolutions.values())
+        envvar, secret = await run_blocking(credentials.get)
+        try:
+            with metrics.span("commit"):
+                await run_blocking(commit_user_statuses, resolutions, envvar, deadline)
+        except DeadlineExceeded as e:
+            # pending requests are kept so the statuses are fetched again
+            logger.error(f"Failed to commit user statuses in time.\n{e}")
+
+    return return_responses
+
+
+def check_mobile_numbers(
+    numbers,
+    concurrency=STATUS_CONCURRENCY,
+    return_exceptions=False,
+    priority=INTERACTIVE,
+    deadline=NO_DEADLINE,
+):
+    """
+    Check a list of mobile numbers for COVID status concurrently. Returns
+    a list of return responses in the same order as numbers.
+
+    Parameters
+    ----------
+    numbers: list
+        User mobile numbers of the format "+91XXXXXXXXXX"
+    concurrency: int
+        Maximum number of mobile numbers resolved at the same time
+    return_exceptions: bool
+        Return the exception raised for a number in place of its response
+        instead of raising it
+    priority: str
+        INTERACTIVE for gate checks or BULK for background work
+    deadline: Deadline
+        Time budget of the invocation
+    """
+
+    with metrics.span("check"):
+        return asyncio.run(
+            check_mobile_numbers_async(
+                numbers, concurrency, return_exceptions, priority, deadline
+            )
+        )
+
+
+def upstream_stats():
+    """
+    Counters of the http transport, empty if Aarogya Setu has not been
+    called by this container yet
+    """
+
+    upstream = sys.modules.get("upstream")
+    return upstream.transport.stats() if upstream else {}
+
+
+def check_mobile_number(number, deadline=NO_DEADLINE):
+    """
+    Check mobile number for COVID status. It first checks user status table
+    for cached entry. If the entry is expired it makes a fresh request and then
+    gets status for the request
+
+    Parameters
+    ----------
+    number: str
+        User mobile number of the format "+91XXXXXXXXXX"
+    deadline: Deadline
+        Time budget of the invocation
+    """
+
+    return check_mobile_numbers([number], deadline=deadline)[0]
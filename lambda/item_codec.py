@@ -0,0 +1,140 @@
+# user status items are stored with short attribute names and the request
+# status as a number code. Colours and messages only get codes for the
+# values the application writes itself, the colours and messages returned
+# by Aarogya Setu are not known in advance and are stored as they are. The
+# key and the ttl attribute keep their names.
+#
+#     stored                              decoded
+#     mobile_number                       mobile_number
+#     expdate                             expdate
+#     s   request status code             request_status
+#     c   colour code or colour           colour
+#     m   message code or message         message
+
+# global variables
+REQUEST_STATUS = "s"
+COLOUR = "c"
+MESSAGE = "m"
+
+# codes count up from 1 in the order of these tables, only ever append.
+# Upstream values can be added once they are known to be fixed.
+REQUEST_STATUSES = ("Approved", "Rejected", "Pending")
+COLOURS = ("0xFFFFFF", "#FFFFFF")
+MESSAGES = ("User as rejected request. Please create a new request",)
+
+REQUEST_STATUS_VALUES = dict(enumerate(REQUEST_STATUSES, 1))
+COLOUR_VALUES = dict(enumerate(COLOURS, 1))
+MESSAGE_VALUES = dict(enumerate(MESSAGES, 1))
+REQUEST_STATUS_CODES = {v: code for code, v in REQUEST_STATUS_VALUES.items()}
+COLOUR_CODES = {v: code for code, v in COLOUR_VALUES.items()}
+MESSAGE_CODES = {v: code for code, v in MESSAGE_VALUES.items()}
+
+
+def encode_value(value, codes):
+    """
+    Encode a value as its code, values without a code are stored as they are
+
+    Parameters
+    ----------
+    value: str
+        Value to encode
+    codes: dict
+        Codes keyed by value
+    """
+
+    return codes.get(value, value)
+
+
+def decode_value(value, values):
+    """
+    Decode a code into its value, values stored as they are are returned
+    unchanged. Codes are read from DynamoDB as Decimals, which look up the
+    same as ints.
+
+    Parameters
+    ----------
+    value: str or Decimal
+        Stored value
+    values: dict
+        Values keyed by code
+    """
+
+    return values.get(value, value)
+
+
+def encode_request_status(request_status):
+    """
+    Get the code of a request status, None if it has no code
+
+    Parameters
+    ----------
+    request_status: str
+        Request status between Approved, Pending and Rejected
+    """
+
+    return REQUEST_STATUS_CODES.get(request_status)
+
+
+def encode_colour(colour):
+    """
+    Get the stored form of a colour
+
+    Parameters
+    ----------
+    colour: str
+        Colour code given by Aarogya Setu
+    """
+
+    return encode_value(colour, COLOUR_CODES)
+
+
+def encode_user_status(item):
+    """
+    Convert a user status item into its stored form
+
+    Parameters
+    ----------
+    item: dict
+        User status item as created by create_user_status_item
+    """
+
+    stored = {
+        "mobile_number": item["mobile_number"],
+        "expdate": item["expdate"],
+        COLOUR: encode_colour(item["colour"]),
+        MESSAGE: encode_value(item["message"], MESSAGE_CODES),
+    }
+
+    # a request status without a code keeps its name and is left out of the
+    # status index, which is keyed on the code
+    code = encode_request_status(item["request_status"])
+    if code is None:
+        stored["request_status"] = item["request_status"]
+    else:
+        stored[REQUEST_STATUS] = code
+
+    return stored
+
+
+def decode_user_status(item):
+    """
+    Convert a stored user status item in place into the shape used by the
+    handlers and return it. Only the attributes present in the item are
+    decoded, so items read from the status index or with a projection can be
+    decoded too.
+
+    Parameters
+    ----------
+    item: dict
+        Item read from the user status table
+    """
+
+    if REQUEST_STATUS in item:
+        code = item.pop(REQUEST_STATUS)
+        item["request_status"] = decode_value(code, REQUEST_STATUS_VALUES)
+    if COLOUR in item:
+        item["colour"] = decode_value(item.pop(COLOUR), COLOUR_VALUES)
+    if MESSAGE in item:
+        item["message"] = decode_value(item.pop(MESSAGE), MESSAGE_VALUES)
+
+    return item
@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import threading
+
+from collections import Counter, defaultdict
+from time import perf_counter, time
+
+# global variables
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "Asetu")
+FUNCTION_NAME = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+MAX_VALUES = 100  # embedded metric format takes up to 100 values per metric
+
+# counters are kept across warm invocations
+counters = Counter()
+lock = threading.Lock()
+
+
+def increment(name, value=1):
+    """
+    Increment a counter
+
+    Parameters
+    ----------
+    name: str
+        Counter name
+    value: int
+        Amount added to the counter
+    """
+
+    with lock:
+        counters[name] += value
+
+
+def snapshot():
+    """Get a copy of all counters"""
+
+    with lock:
+        return dict(counters)
+
+
+# timings and counts of the current invocation, cleared by emit()
+timings = defaultdict(list)
+dimension_counts = Counter()
+
+
+class Span:
+    """
+    Times a phase of an invocation. Use as a context manager, the duration
+    is recorded when the block exits whether or not it raised.
+
+    Attributes
+    ----------
+    name: str
+        Phase name
+    """
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record_time(self.name, perf_counter() - self.start)
+
+
+def span(name):
+    """
+    Time a phase of an invocation
+
+    Parameters
+    ----------
+    name: str
+        Phase name
+    """
+
+    return Span(name)
+
+
+def record_time(name, seconds):
+    """
+    Record the duration of a phase
+
+    Parameters
+    ----------
+    name: str
+        Phase name
+    seconds: float
+        Duration of the phase
+    """
+
+    with lock:
+        timings[name].append(seconds * 1000)
+
+
+def count(metric, dimension, value):
+    """
+    Count an event of the current invocation by the value of a dimension,
+    such as the cache outcome of a mobile number
+
+    Parameters
+    ----------
+    metric: str
+        Metric name
+    dimension: str
+        Dimension name
+    value: str
+        Dimension value
+    """
+
+    with lock:
+        dimension_counts[(metric, dimension, value)] += 1
+
+
+def create_document(dimensions, values, units):
+    """
+    Create an embedded metric format document
+
+    Parameters
+    ----------
+    dimensions: dict
+        Dimension values keyed by dimension name
+    values: dict
+        Metric values keyed by metric name
+    units: dict
+        Metric units keyed by metric name
+    """
+
+    document = {
+        "_aws": {
+            "Timestamp": int(time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [{"Name": n, "Unit": units[n]} for n in values],
+                }
+            ],
+        }
+    }
+    document.update(dimensions)
+    document.update(values)
+
+    return document
+
+
+def emit(stream=None):
+    """
+    Print the timings and counts of the invocation as embedded metric format
+    log lines, which CloudWatch turns into metrics, and clear them. Returns
+    the printed documents.
+
+    Parameters
+    ----------
+    stream: file
+        Stream the lines are written to, standard output by default
+    """
+
+    with lock:
+        phases = {name: values[:MAX_VALUES] for name, values in timings.items()}
+        counts = dict(dimension_counts)
+        timings.clear()
+        dimension_counts.clear()
+
+    dimensions = {"Function": FUNCTION_NAME}
+    documents = []
+
+    if phases:
+        values = {f"{name}_ms": phase for name, phase in phases.items()}
+        units = {name: "Milliseconds" for name in values}
+        documents.append(create_document(dimensions, values, units))
+
+    for (metric, dimension, value), total in sorted(counts.items()):
+        documents.append(
+            create_document(
+                {**dimensions, dimension: value}, {metric: total}, {metric: "Count"}
+            )
+        )
+
+    stream = stream or sys.stdout
+    for document in documents:
+        stream.write(json.dumps(document, separators=(",", ":")) + "\n")
+    stream.flush()
+
+    return documents
@@ -0,0 +1,30 @@
+import logging
+import metrics
+
+from get_status import token_broker
+from profiling import profiled
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+@profiled
+def handler(event, context):
+    """
+    Runs on a schedule and mints Aarogya Setu tokens ahead of demand so
+    that new requests can lease a ready token from the pool.
+
+    Parameters
+    ----------
+    event: dict
+        event parameters passed to function
+    context: dict
+        context parameters passed to function
+    """
+
+    added = token_broker.top_up()
+    logger.info(f"Added {added} tokens to the token pool")
+    metrics.emit()
+
+    return {"added": added}
@@ -0,0 +1,50 @@
+import re
+
+# global variables
+MOBILE_NUMBER_EXPRESSION = re.compile(r"^\+91\d{10}$")
+SEPARATORS_EXPRESSION = re.compile(r"[\s\-().]")
+COUNTRY_CODE = "+91"
+
+# marks a mobile number Aarogya Setu rejected as invalid
+INVALID_NUMBER = object()
+
+
+def valid_mobile_number(number):
+    """
+    Check if the mobile number is valid
+
+    Parameters
+    ----------
+    number: str
+        User mobile number of the format "+91XXXXXXXXXX"
+    """
+
+    return MOBILE_NUMBER_EXPRESSION.match(number)
+
+
+def normalise_mobile_number(number):
+    """
+    Normalise a mobile number to the format "+91XXXXXXXXXX". Spaces, dashes,
+    dots and brackets are removed and a missing country code is added.
+    Returns None if the result is not a valid mobile number.
+
+    Parameters
+    ----------
+    number: str
+        User mobile number such as "+91 XXXXX XXXXX", "91XXXXXXXXXX",
+        "0XXXXXXXXXX" or "XXXXXXXXXX"
+    """
+
+    number = SEPARATORS_EXPRESSION.sub("", number)
+
+    if len(number) == 10 and number.isdigit():
+        number = COUNTRY_CODE + number
+    elif len(number) == 11 and number.startswith("0"):
+        number = COUNTRY_CODE + number[1:]
+    elif len(number) == 12 and number.startswith("91"):
+        number = "+" + number
+
+    if valid_mobile_number(number):
+        return number
+    else:
+        return None
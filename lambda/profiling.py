@@ -0,0 +1,172 @@
+import io
+import os
+import time
+import random
+import logging
+import functools
+
+# create logger
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# global variables
+PROFILE = os.environ.get("PROFILE", "").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", int(PROFILE)))
+PROFILE_OUTPUT = os.environ.get("PROFILE_OUTPUT", "log")  # "log" or a directory
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", 15))
+TRACEMALLOC_FRAMES = 1
+
+
+def profiled(handler):
+    """
+    Profile a Lambda handler when PROFILE is set or PROFILE_SAMPLE_RATE is
+    above zero. A sampled invocation runs under cProfile and tracemalloc and
+    a summary of the slowest functions, the peak memory and the largest
+    allocation sites is written to PROFILE_OUTPUT. The handler is returned
+    unchanged when profiling is off, so it costs nothing.
+
+    cProfile only sees the thread that runs the handler, work done in
+    thread pools shows up as time spent waiting on it. tracemalloc sees the
+    allocations of every thread.
+
+    Parameters
+    ----------
+    handler: callable
+        Lambda handler taking an event and a context
+    """
+
+    if PROFILE_SAMPLE_RATE <= 0:
+        return handler
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if random.random() >= PROFILE_SAMPLE_RATE:
+            return handler(event, context)
+        return profile_call(handler, event, context)
+
+    return wrapper
+
+
+def profile_call(handler, event, context):
+    """
+    Call a handler under cProfile and tracemalloc and write a summary
+
+    Parameters
+    ----------
+    handler: callable
+        Lambda handler taking an event and a context
+    event: dict
+        event parameters passed to function
+    context: dict
+        context parameters passed to function
+    """
+
+    # only imported once an invocation is sampled
+    import cProfile
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        return handler(event, context)
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+
+        name = f"{handler.__module__}.{handler.__name__}"
+        summary = summarise(name, elapsed, profiler, peak, snapshot)
+        write_summary(name, summary, profiler)
+
+
+def summarise(name, elapsed, profiler, peak, snapshot, top=PROFILE_TOP):
+    """
+    Create a text summary of a profiled invocation
+
+    Parameters
+    ----------
+    name: str
+        Handler name
+    elapsed: float
+        Seconds the invocation took
+    profiler: cProfile.Profile
+        Profiler that ran during the invocation
+    peak: int
+        Peak traced memory in bytes
+    snapshot: tracemalloc.Snapshot
+        Allocations that were still alive at the end of the invocation
+    top: int
+        Number of functions and allocation sites listed
+    """
+
+    import pstats
+    import tracemalloc
+
+    lines = [
+        f"Profile of {name}: {elapsed * 1000:.1f} ms, "
+        f"peak traced memory {peak / 1024:.0f} KiB",
+        f"Top {top} functions by cumulative time:",
+    ]
+
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(top)
+    # skip the preamble pstats prints before the table
+    table = stream.getvalue().splitlines()
+    first = next((i for i, line in enumerate(table) if "ncalls" in line), 0)
+    lines.extend(line for line in table[first:] if line.strip())
+
+    lines.append(f"Top {top} allocation sites still alive:")
+    snapshot = snapshot.filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+    )
+    for statistic in snapshot.statistics("lineno")[:top]:
+        lines.append(f"  {statistic}")
+
+    return "\n".join(lines)
+
+
+def write_summary(name, summary, profiler):
+    """
+    Write a profile summary to the log, or to a directory along with the
+    raw profile which can be loaded with pstats
+
+    Parameters
+    ----------
+    name: str
+        Handler name
+    summary: str
+        Text summary of the invocation
+    profiler: cProfile.Profile
+        Profiler that ran during the invocation
+    """
+
+    if PROFILE_OUTPUT == "log":
+        logger.info(summary)
+        return
+
+    try:
+        os.makedirs(PROFILE_OUTPUT, exist_ok=True)
+        path = os.path.join(PROFILE_OUTPUT, f"{name}-{int(time.time() * 1000)}")
+        with open(f"{path}.txt", "w") as f:
+            f.write(summary + "\n")
+        profiler.dump_stats(f"{path}.prof")
+    except OSError as e:
+        logger.error(f"Failed to write profile to {PROFILE_OUTPUT}.\n{e}")
+        logger.info(summary)
+        return
+
+    logger.info(f"Wrote profile of {name} to {path}.txt")
@@ -1,20 +1,22 @@
-import os
 import logging
-import boto3
+import metrics
 
-from botocore.exceptions import ClientError
-from get_status import check_mobile_number
+from deadline import Deadline
+from get_status import cache_tier, check_mobile_numbers, status_cache, upstream_stats
+from rate_limiter import BULK
+from profiling import profiled
 
-sqs = boto3.resource("sqs")
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+@profiled
 def handler(event, context):
     """
-    Receive single message from queue and check status with Aarogya Setu.
-    Delete message after checking status
+    Receive a batch of messages from queue and check their status with
+    Aarogya Setu concurrently. Messages are deleted by the event source
+    mapping, except the ones reported as failed which are retried.
 
     Parameters
     ----------
@@ -24,20 +26,34 @@ def handler(event, context):
         context parameters passed to function
     """
 
-    # queue event sent sends only one number at a time
-    mobile_number = None
-    message = event["Records"][0]
-    if message:
-        mobile_number = message.get("body")
-
-    return_status = check_mobile_number(mobile_number)
-    logger.info(return_status)
-
-    # delete request from queue
-    queue = sqs.Queue(os.environ["QUEUE_URL"])
-    try:
-        queue.delete_messages(
-            Entries=[{"Id": "1", "ReceiptHandle": message["receiptHandle"]}]
-        )
-    except ClientError as e:
-        logger.error(f"Failed to delete message {message}.\n{e}")
+    records = event["Records"]
+    numbers = [record.get("body") for record in records]
+
+    # bulk checks give way to interactive gate checks when upstream is busy
+    # numbers left when time runs short are reported as failed and retried
+    return_statuses = check_mobile_numbers(
+        numbers,
+        return_exceptions=True,
+        priority=BULK,
+        deadline=Deadline.from_context(context),
+    )
+
+    # report numbers that could not be checked so only they are retried
+    failures = []
+    for record, return_status in zip(records, return_statuses):
+        if isinstance(return_status, BaseException):
+            logger.error(f"Failed to check {record.get('body')}.\n{return_status}")
+            failures.append({"itemIdentifier": record["messageId"]})
+            continue
+
+        logger.info(return_status)
+        if return_status["statusCode"] >= 500:
+            failures.append({"itemIdentifier": record["messageId"]})
+
+    logger.info(upstream_stats())
+    logger.info(status_cache.stats())
+    logger.info(cache_tier.stats())
+    logger.info(metrics.snapshot())
+    metrics.emit()
+
+    return {"batchItemFailures": failures}
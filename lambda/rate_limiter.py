@@ -0,0 +1,357 @@
+import os
+import time
+import random
+import logging
+import threading
+
+from decimal import Decimal
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import BotoCoreError, ClientError
+from clients import dynamodb
+from deadline import MIN_CALL_SECONDS, NO_DEADLINE
+
+# global variables
+INTERACTIVE = "interactive"
+BULK = "bulk"
+BURST_SECONDS = 2  # bucket capacity in seconds worth of tokens
+BULK_RESERVE_FRACTION = float(os.environ.get("BULK_RESERVE_FRACTION", 0.25))
+MAX_WAIT_SECONDS = {INTERACTIVE: 1.0, BULK: 3.0}
+SLOWDOWN_FACTOR = 0.5
+MIN_RATE_FACTOR = 0.1
+RECOVERY_PER_SECOND = 0.05
+SLOW_DOWN_ATTEMPTS = 3
+THROTTLE_CODES = (429, 500, 502, 503, 504)
+CONFLICT_BACKOFF_SECONDS = 0.02  # first backoff after a conflicting write
+MAX_CONFLICT_BACKOFF_SECONDS = 0.5
+
+# returned by _take when another caller updated the bucket first
+CONFLICT = object()
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def refill(state, rate, capacity, now):
+    """
+    Add the tokens earned since the bucket was last updated. The rate factor
+    recovers towards 1 over time after a slowdown. Returns a tuple of tokens
+    and rate factor.
+
+    Parameters
+    ----------
+    state: tuple
+        Tokens, update time and rate factor of the bucket
+    rate: float
+        Tokens added per second at full speed
+    capacity: float
+        Maximum number of tokens in the bucket
+    now: float
+        Current timestamp
+    """
+
+    tokens, updated_at, rate_factor = state
+    elapsed = max(now - updated_at, 0)
+    rate_factor = min(1.0, rate_factor + elapsed * RECOVERY_PER_SECOND)
+    tokens = min(capacity, tokens + elapsed * rate * rate_factor)
+
+    return tokens, rate_factor
+
+
+def conflict_backoff(conflicts):
+    """
+    Seconds to wait before taking a token again after conflicting writes.
+    The backoff grows with every conflict and is jittered, so that callers
+    competing for the shared bucket spread out instead of retrying in step.
+
+    Parameters
+    ----------
+    conflicts: int
+        Number of conflicting writes of this acquire so far
+    """
+
+    backoff = CONFLICT_BACKOFF_SECONDS * 2 ** (conflicts - 1)
+    return random.uniform(0, min(backoff, MAX_CONFLICT_BACKOFF_SECONDS))
+
+
+class TokenBucket:
+    """
+    An in-memory token bucket. Used when no DynamoDB table is configured and
+    as a local stand-in for the shared bucket.
+
+    Bulk callers may not take the last BULK_RESERVE_FRACTION of the tokens,
+    which are kept for interactive callers. Throttling responses from the
+    upstream slow the bucket down until it recovers.
+
+    Attributes
+    ----------
+    name: str
+        Bucket name
+    rate: float
+        Tokens added per second at full speed
+    capacity: float
+        Maximum number of tokens in the bucket
+    """
+
+    def __init__(self, name, rate):
+        self.name = name
+        self.rate = rate
+        self.capacity = rate * BURST_SECONDS
+        self._state = (self.capacity, time.time(), 1.0)
+        self._lock = threading.Lock()
+
+    def acquire(self, priority=INTERACTIVE, max_wait=None):
+        """
+        Take a token, waiting up to MAX_WAIT_SECONDS for the priority.
+        Returns False if no token became available in time.
+
+        Parameters
+        ----------
+        priority: str
+            INTERACTIVE or BULK
+        max_wait: float
+            Waits no longer than this many seconds if it is set
+        """
+
+        floor = self.capacity * BULK_RESERVE_FRACTION if priority == BULK else 0
+        wait_seconds = MAX_WAIT_SECONDS[priority]
+        if max_wait is not None:
+            wait_seconds = min(wait_seconds, max_wait)
+        deadline = time.time() + wait_seconds
+
+        conflicts = 0
+        while True:
+            wait = self._take(floor, time.time())
+            if wait is None:
+                return True
+            if wait is CONFLICT:
+                conflicts += 1
+                wait = conflict_backoff(conflicts)
+
+            # the bucket is only read again if there is time left to wait
+            if time.time() + wait > deadline:
+                logger.info(f"Rate limited {priority} call to {self.name}")
+                return False
+            time.sleep(wait)
+
+    def slow_down(self, deadline=NO_DEADLINE):
+        """
+        Lower the rate after the upstream returned a throttling response
+
+        Parameters
+        ----------
+        deadline: Deadline
+            Time budget of the invocation
+        """
+
+        with self._lock:
+            tokens, updated_at, rate_factor = self._state
+            rate_factor = max(MIN_RATE_FACTOR, rate_factor * SLOWDOWN_FACTOR)
+            self._state = (tokens, updated_at, rate_factor)
+
+    def _take(self, floor, now):
+        """
+        Take a token if one is available above floor. Returns None if a token
+        was taken, CONFLICT if another caller updated the bucket first,
+        otherwise the number of seconds until one is available.
+        """
+
+        with self._lock:
+            tokens, rate_factor = refill(self._state, self.rate, self.capacity, now)
+
+            if tokens - 1 >= floor:
+                self._state = (tokens - 1, now, rate_factor)
+                return None
+
+            self._state = (tokens, now, rate_factor)
+            return (1 + floor - tokens) / (self.rate * rate_factor)
+
+
+class DynamoDBTokenBucket(TokenBucket):
+    """
+    A token bucket stored in DynamoDB and shared by every invocation. The
+    bucket is updated with a conditional write on its update time, so
+    concurrent callers never take the same token. Callers whose write
+    conflicts back off with jitter before reading the bucket again.
+
+    Attributes
+    ----------
+    name: str
+        Bucket name
+    rate: float
+        Tokens added per second at full speed
+    capacity: float
+        Maximum number of tokens in the bucket
+    table_name: str
+        Upstream state table name
+    """
+
+    def __init__(self, name, rate, table_name):
+        super().__init__(name, rate)
+        self.table_name = table_name
+
+    @property
+    def key(self):
+        return f"bucket#{self.name}"
+
+    def slow_down(self, deadline=NO_DEADLINE):
+        """
+        Lower the rate after the upstream returned a throttling response. The
+        shared bucket is left as it is once the deadline is too close.
+
+        Parameters
+        ----------
+        deadline: Deadline
+            Time budget of the invocation
+        """
+
+        table = dynamodb().Table(self.table_name)
+
+        for _ in range(SLOW_DOWN_ATTEMPTS):
+            if deadline.remaining() < MIN_CALL_SECONDS:
+                logger.info(f"No time left to slow down token bucket {self.name}")
+                return
+
+            now = time.time()
+            try:
+                state, condition = self._read(table, now)
+            except (BotoCoreError, ClientError) as e:
+                logger.error(f"Failed to read token bucket {self.name}.\n{e}")
+                return
+
+            tokens, rate_factor = refill(state, self.rate, self.capacity, now)
+            rate_factor = max(MIN_RATE_FACTOR, rate_factor * SLOWDOWN_FACTOR)
+            if self._write(table, (tokens, now, rate_factor), condition):
+                return
+
+    def _read(self, table, now):
+        """
+        Read the bucket state. Returns a tuple of the state and the condition
+        a write must meet to replace it.
+        """
+
+        item = table.get_item(Key={"name": self.key}, ConsistentRead=True).get("Item")
+
+        if item is None:
+            return (self.capacity, now, 1.0), Attr("name").not_exists()
+
+        state = (
+            float(item["tokens"]),
+            float(item["updated_at"]),
+            float(item.get("rate_factor", 1)),
+        )
+        return state, Attr("updated_at").eq(item["updated_at"])
+
+    def _write(self, table, state, condition):
+        """
+        Write the bucket state if nobody else updated it since it was read.
+        Returns False if another caller updated it first.
+        """
+
+        tokens, updated_at, rate_factor = state
+
+        try:
+            table.put_item(
+                Item={
+                    "name": self.key,
+                    "tokens": Decimal(str(tokens)),
+                    "updated_at": Decimal(str(updated_at)),
+                    "rate_factor": Decimal(str(rate_factor)),
+                },
+                ConditionExpression=condition,
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            logger.error(f"Failed to update token bucket {self.name}.\n{e}")
+        except BotoCoreError as e:
+            logger.error(f"Failed to update token bucket {self.name}.\n{e}")
+
+        return True
+
+    def _take(self, floor, now):
+        table = dynamodb().Table(self.table_name)
+
+        try:
+            state, condition = self._read(table, now)
+        except (BotoCoreError, ClientError) as e:
+            # never block upstream calls because the bucket cannot be read
+            logger.error(f"Failed to read token bucket {self.name}.\n{e}")
+            return None
+
+        tokens, rate_factor = refill(state, self.rate, self.capacity, now)
+        if tokens - 1 < floor:
+            return (1 + floor - tokens) / (self.rate * rate_factor)
+
+        if self._write(table, (tokens - 1, now, rate_factor), condition):
+            return None
+        else:
+            return CONFLICT
+
+
+class RateLimiter:
+    """
+    Rate limits calls to upstream endpoints with one token bucket per
+    endpoint. Buckets are shared through DynamoDB if table_name is set,
+    otherwise they are kept in memory.
+
+    Attributes
+    ----------
+    buckets: dict
+        Token bucket keyed by endpoint url
+    """
+
+    def __init__(self, rates, table_name=None):
+        """
+        Parameters
+        ----------
+        rates: dict
+            Bucket name and tokens per second keyed by endpoint url
+        table_name: str
+            Upstream state table name
+        """
+
+        self.buckets = {}
+        for url, (name, rate) in rates.items():
+            if table_name:
+                self.buckets[url] = DynamoDBTokenBucket(name, rate, table_name)
+            else:
+                self.buckets[url] = TokenBucket(name, rate)
+
+    def acquire(self, url, priority=INTERACTIVE, max_wait=None):
+        """
+        Wait for permission to call an endpoint. Returns False if the call
+        should not be made because the endpoint is over its budget.
+
+        Parameters
+        ----------
+        url: str
+            Endpoint url
+        priority: str
+            INTERACTIVE or BULK
+        max_wait: float
+            Waits no longer than this many seconds if it is set
+        """
+
+        bucket = self.buckets.get(url)
+        return bucket is None or bucket.acquire(priority, max_wait)
+
+    def record(self, url, status_code, deadline=NO_DEADLINE):
+        """
+        Record the status code an endpoint answered with, slowing down the
+        endpoint if it is throttling or failing
+
+        Parameters
+        ----------
+        url: str
+            Endpoint url
+        status_code: int
+            HTTP status code of the response
+        deadline: Deadline
+            Time budget of the invocation
+        """
+
+        bucket = self.buckets.get(url)
+        if bucket is not None and status_code in THROTTLE_CODES:
+            logger.info(f"Slowing down calls to {bucket.name}")
+            bucket.slow_down(deadline)
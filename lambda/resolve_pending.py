@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+import logging
+import metrics
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+from datetime import datetime
+from clients import dynamodb
+from deadline import NO_DEADLINE
+from rate_limiter import BULK
+from get_status import (
+    PENDING,
+    STATUS_CONCURRENCY,
+    commit_user_statuses,
+    credentials,
+    run_blocking,
+    status_from_content,
+)
+from upstream import get_status_content
+from profiling import profiled
+
+# global variables
+RESOLVE_RATE_PER_SECOND = float(os.environ.get("RESOLVE_RATE_PER_SECOND", 5))
+RESOLVE_PAGE_SIZE = 100
+RESOLVE_TIME_RESERVE_MILLIS = 30000
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+async def resolve_pending_request(item, secret, semaphore, start_at):
+    """
+    Get the status of a pending request. Returns a tuple of mobile number,
+    status and request status if the request was approved or rejected, and
+    None if it is still pending or the status could not be fetched.
+
+    Parameters
+    ----------
+    item: dict
+        Item from pending requests table
+    secret: Secret
+        Object contains secrets
+    semaphore: asyncio.Semaphore
+        Bounds the number of requests checked at the same time
+    start_at: float
+        Time at which the request may be sent, used to limit the rate
+    """
+
+    await asyncio.sleep(max(start_at - time.monotonic(), 0))
+
+    number = item["mobile_number"]
+    async with semaphore:
+        content = await run_blocking(
+            get_status_content,
+            number,
+            item["token"],
+            item["request_id"],
+            secret,
+            BULK,
+            NO_DEADLINE,
+            credentials,
+        )
+
+    if content is None or content["request_status"] == PENDING:
+        return None
+
+    status = status_from_content(content, secret)
+    return number, status, content["request_status"]
+
+
+async def resolve_pending_requests(items, secret):
+    """
+    Get the status of pending requests concurrently, sending at most
+    RESOLVE_RATE_PER_SECOND requests per second to Aarogya Setu. Returns the
+    resolutions of requests that were approved or rejected.
+
+    Parameters
+    ----------
+    items: list
+        Items from pending requests table
+    secret: Secret
+        Object contains secrets
+    """
+
+    semaphore = asyncio.Semaphore(STATUS_CONCURRENCY)
+    interval = 1 / RESOLVE_RATE_PER_SECOND
+    now = time.monotonic()
+
+    resolutions = await asyncio.gather(
+        *(
+            resolve_pending_request(item, secret, semaphore, now + i * interval)
+            for i, item in enumerate(items)
+        )
+    )
+
+    return [resolution for resolution in resolutions if resolution is not None]
+
+
+@profiled
+def handler(event, context):
+    """
+    Runs on a schedule and pages through the pending requests table. The
+    status of every unexpired request is fetched from Aarogya Setu and the
+    approved and rejected ones are committed to the user status table, so
+    statuses become available without anyone polling for them.
+
+    Parameters
+    ----------
+    event: dict
+        event parameters passed to function
+    context: dict
+        context parameters passed to function
+    """
+
+    envvar, secret = credentials.get()
+    table = dynamodb().Table(envvar.REQUESTS_TABLE)
+    now = int(datetime.now().timestamp())
+
+    # skip expired requests and leases that do not have a request yet
+    kwargs = {
+        "FilterExpression": Attr("expdate").gte(now) & Attr("request_id").exists(),
+        "Limit": RESOLVE_PAGE_SIZE,
+    }
+    checked = 0
+    resolved = 0
+
+    while True:
+        try:
+            page = table.scan(**kwargs)
+        except ClientError as e:
+            logger.error(f"Failed to scan pending requests.\n{e}")
+            break
+
+        resolutions = asyncio.run(resolve_pending_requests(page["Items"], secret))
+        commit_user_statuses(resolutions, envvar)
+        checked += len(page["Items"])
+        resolved += len(resolutions)
+
+        if "LastEvaluatedKey" not in page:
+            break
+        kwargs["ExclusiveStartKey"] = page["LastEvaluatedKey"]
+
+        # leave the rest for the next run rather than getting cut off
+        if context.get_remaining_time_in_millis() < RESOLVE_TIME_RESERVE_MILLIS:
+            logger.info("Running out of time, stopping early")
+            break
+
+    logger.info(f"Checked {checked} pending requests and resolved {resolved}")
+    metrics.emit()
+
+    return {"checked": checked, "resolved": resolved}
@@ -1,15 +1,35 @@
 import os
 import json
-import boto3
+import base64
 import logging
 
+from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError
 from datetime import datetime
-
+from clients import dynamodb
+from item_codec import (
+    COLOUR,
+    MESSAGE,
+    REQUEST_STATUS,
+    decode_user_status,
+    encode_colour,
+    encode_request_status,
+)
+from profiling import profiled
 
 USER_STATUS_EXPIRY_DAYS = 0.9
+MAX_PAGE_SIZE = 1000
+DEFAULT_REQUEST_STATUSES = "Approved,Rejected"
+STATUS_INDEX = os.environ.get("STATUS_INDEX")
+
+# only the attributes rendered by the frontend are read from the index
+PROJECTION_EXPRESSION = "#mobile_number, #message, #colour"
+PROJECTION_NAMES = {
+    "#mobile_number": "mobile_number",
+    "#message": MESSAGE,
+    "#colour": COLOUR,
+}
 
-ddb = boto3.resource("dynamodb")
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -49,9 +69,179 @@ def create_response(status_code, body):
     }
 
 
+def encode_next_token(position):
+    """
+    Encode the position a read stopped at as an opaque pagination token
+
+    Parameters
+    ----------
+    position: dict
+        Request status being read and the LastEvaluatedKey of the last page
+    """
+
+    if position is None:
+        return None
+
+    # the expdate of the last evaluated key is read as a Decimal
+    position = json.dumps(position, default=int)
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_next_token(next_token):
+    """
+    Decode a pagination token into the position a read should start from.
+    Raises ValueError if the token is malformed.
+
+    Parameters
+    ----------
+    next_token: str
+        Token returned by a previous page
+    """
+
+    try:
+        position = json.loads(base64.urlsafe_b64decode(next_token.encode()))
+    except Exception:
+        raise ValueError(f"Invalid next_token {next_token}")
+
+    if not isinstance(position, dict) or "request_status" not in position:
+        raise ValueError(f"Invalid next_token {next_token}")
+
+    return position
+
+
+def encode_item(item):
+    """
+    Encode an item as it is returned to the frontend
+
+    Parameters
+    ----------
+    item: dict
+        Item from user status table
+    """
+
+    item = decode_user_status(item)
+    item.pop("expdate", None)
+    item.pop("request_status", None)
+
+    item["colour"] = "#FFFFFF"  # temporary
+    return json.dumps(item)
+
+
+def status_query(request_status, parameters):
+    """
+    Create keyword arguments for a query on the status index that reads
+    unexpired items with the given request status. Items can be filtered
+    server side with the colour and exclude_colour parameters.
+
+    Parameters
+    ----------
+    request_status: str
+        Request status to read
+    parameters: dict
+        Query string parameters of the request
+    """
+
+    code = encode_request_status(request_status)
+    if code is None:
+        raise ValueError(f"Invalid request_status {request_status}")
+
+    now = int(datetime.now().timestamp())
+    kwargs = {
+        "IndexName": STATUS_INDEX,
+        "KeyConditionExpression": Key(REQUEST_STATUS).eq(code) & Key("expdate").gt(now),
+        "ProjectionExpression": PROJECTION_EXPRESSION,
+        "ExpressionAttributeNames": dict(PROJECTION_NAMES),
+    }
+
+    if "colour" in parameters:
+        colour = encode_colour(parameters["colour"])
+        kwargs["FilterExpression"] = Attr(COLOUR).eq(colour)
+    elif "exclude_colour" in parameters:
+        colour = encode_colour(parameters["exclude_colour"])
+        kwargs["FilterExpression"] = Attr(COLOUR).ne(colour)
+
+    return kwargs
+
+
+def request_statuses(parameters):
+    """
+    Get the list of request statuses to read from the request_status
+    parameter, which holds comma separated request statuses
+
+    Parameters
+    ----------
+    parameters: dict
+        Query string parameters of the request
+    """
+
+    statuses = parameters.get("request_status", DEFAULT_REQUEST_STATUSES)
+    statuses = [status for status in statuses.split(",") if status]
+    if not statuses:
+        raise ValueError(f"Invalid request_status {parameters['request_status']}")
+
+    return statuses
+
+
+def page_statuses(table_name, parameters, limit):
+    """
+    Query a single page of the status index and return a JSON object holding
+    its items and the token for the next page
+
+    Parameters
+    ----------
+    table_name: str
+        User status table name
+    parameters: dict
+        Query string parameters of the request
+    limit: int
+        Maximum number of items read for this page
+    """
+
+    table = dynamodb().Table(table_name)
+    statuses = request_statuses(parameters)
+
+    if "next_token" in parameters:
+        position = decode_next_token(parameters["next_token"])
+    else:
+        position = {"request_status": statuses[0]}
+
+    if position["request_status"] not in statuses:
+        raise ValueError(f"Invalid next_token {parameters['next_token']}")
+
+    kwargs = status_query(position["request_status"], parameters)
+    kwargs["Limit"] = limit
+    if "key" in position:
+        kwargs["ExclusiveStartKey"] = position["key"]
+
+    page = table.query(**kwargs)
+    fragments = [encode_item(item) for item in page["Items"]]
+
+    # continue with the next request status once this one is exhausted
+    next_position = None
+    if "LastEvaluatedKey" in page:
+        next_position = {
+            "request_status": position["request_status"],
+            "key": page["LastEvaluatedKey"],
+        }
+    else:
+        index = statuses.index(position["request_status"]) + 1
+        if index < len(statuses):
+            next_position = {"request_status": statuses[index]}
+
+    token = json.dumps(encode_next_token(next_position))
+    return '{"items": [' + ", ".join(fragments) + '], "next_token": ' + token + "}"
+
+
+@profiled
 def handler(event, context):
     """
-    Scans user status table and returns payload of upto 1 MB in size
+    Returns unexpired items from the user status table. Items are read from
+    the status index, filtered by the request_status, colour and
+    exclude_colour query parameters. A page of items and a next_token are
+    returned, pages hold up to MAX_PAGE_SIZE items unless the limit
+    parameter asks for fewer, so the response size stays bounded as the
+    table grows. Full exports are not served here, they are run with
+    export_statuses.py.
 
     Parameters
     ----------
@@ -62,25 +252,18 @@ def handler(event, context):
     """
 
     USER_STATUS_TABLE = os.environ.get("USER_STATUS_TABLE")
-    table = ddb.Table(USER_STATUS_TABLE)
+    parameters = event.get("queryStringParameters") or {}
 
     try:
-        data = table.scan()  # returns a payload of max 1 MB
+        limit = min(int(parameters.get("limit", MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError(f"Invalid limit {limit}")
+        body = page_statuses(USER_STATUS_TABLE, parameters, limit)
+    except ValueError as e:
+        logger.error(f"Invalid scan parameters.\n{e}")
+        return create_response(400, json.dumps(str(e)))
     except ClientError as e:
-        logger.error(f"Unable to scan table {USER_STATUS_TABLE}.\n{e}")
+        logger.error(f"Unable to read table {USER_STATUS_TABLE}.\n{e}")
         return create_response(502, json.dumps([]))
 
-    items = []
-    for item in data["Items"]:
-
-        # ignore expired items
-        if item["expdate"] < str(int(datetime.now().timestamp())):
-            continue
-
-        del item["expdate"]
-        del item["request_status"]
-
-        item["colour"] = "#FFFFFF"  # temporary
-        items.append(item)
-
-    return create_response(200, json.dumps(items))
+    return create_response(200, body)
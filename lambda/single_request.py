@@ -1,13 +1,17 @@
 import json
 import logging
+import metrics
 
-from get_status import check_mobile_number
+from deadline import Deadline
+from get_status import cache_tier, check_mobile_number, status_cache, upstream_stats
+from profiling import profiled
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+@profiled
 def handler(event, context):
     """
     Receive a mobile number and query Aarogya Setu about it's status.
@@ -26,7 +30,14 @@ def handler(event, context):
     if body:
         mobile_number = json.loads(body).get("mobile_number")
 
-    return_status = check_mobile_number(mobile_number)
+    # stop early with a retry response rather than being timed out
+    deadline = Deadline.from_context(context)
+    return_status = check_mobile_number(mobile_number, deadline)
     logger.info(return_status)
+    logger.info(upstream_stats())
+    logger.info(status_cache.stats())
+    logger.info(cache_tier.stats())
+    logger.info(metrics.snapshot())
+    metrics.emit()
 
     return return_status
@@ -0,0 +1,209 @@
+import os
+import random
+import logging
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+from datetime import datetime
+from clients import dynamodb
+from deadline import NO_DEADLINE
+from rate_limiter import BULK, INTERACTIVE
+
+# global variables
+TOKEN_VALIDITY_SECONDS = 3600
+TOKEN_MIN_VALIDITY_SECONDS = int(os.environ.get("TOKEN_MIN_VALIDITY_SECONDS", 1800))
+TOKEN_POOL_SIZE = int(os.environ.get("TOKEN_POOL_SIZE", 20))
+TOKEN_POOL_NAME = "tokens"
+LEASE_CANDIDATES = 5
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def now():
+    """Current time as an integer epoch timestamp"""
+
+    return int(datetime.now().timestamp())
+
+
+def create_token_id(expdate):
+    """
+    Create a sort key for a pooled token. Tokens sort by expiry date because
+    the zero padded expiry date is used as the prefix.
+
+    Parameters
+    ----------
+    expdate: int
+        Expiry date timestamp of the token
+    """
+
+    return f"{expdate:012d}#{random.getrandbits(32):08x}"
+
+
+class TokenBroker:
+    """
+    Hands out Aarogya Setu tokens from a pool of tokens minted ahead of
+    demand. The pool is stored in DynamoDB and a token is leased by deleting
+    it with a conditional write, so two invocations never get the same token.
+    A leased token is used for exactly one request, which respects the rule
+    that a token is only good for one successful status request.
+
+    Attributes
+    ----------
+    table_name: str
+        Token pool table name, tokens are minted on demand if it is not set
+    mint: callable
+        Function that takes a rate limit priority and a deadline and returns
+        a new token from Aarogya Setu or None
+    min_validity: int
+        Minimum number of seconds a token must remain valid to be leased
+    """
+
+    def __init__(self, table_name, mint, min_validity=TOKEN_MIN_VALIDITY_SECONDS):
+        self.table_name = table_name
+        self.mint = mint
+        self.min_validity = min_validity
+
+    def lease(self, priority=INTERACTIVE, deadline=NO_DEADLINE):
+        """
+        Lease a token from the pool. Falls back to minting a token if the pool
+        is empty. Returns a tuple of token and expiry date or None if a token
+        could not be minted either.
+
+        Parameters
+        ----------
+        priority: str
+            Rate limit priority used if a token has to be minted
+        deadline: Deadline
+            Time budget of the invocation
+        """
+
+        if self.table_name:
+            leased = self._lease_from_pool(deadline)
+            if leased is not None:
+                return leased
+            logger.info("Token pool is empty, minting a token on demand")
+
+        return self.mint_token(priority, deadline)
+
+    def mint_token(self, priority=INTERACTIVE, deadline=NO_DEADLINE):
+        """
+        Mint a new token. Returns a tuple of token and expiry date or None
+
+        Parameters
+        ----------
+        priority: str
+            Rate limit priority of the call to Aarogya Setu
+        deadline: Deadline
+            Time budget of the invocation
+        """
+
+        expdate = now() + TOKEN_VALIDITY_SECONDS
+        token = self.mint(priority, deadline)
+
+        if token is None:
+            return None
+        else:
+            return token, expdate
+
+    def available(self):
+        """Count the tokens in the pool that can still be leased"""
+
+        table = dynamodb().Table(self.table_name)
+        count = 0
+        kwargs = {
+            "KeyConditionExpression": self._leasable_condition(),
+            "Select": "COUNT",
+        }
+
+        while True:
+            response = table.query(**kwargs)
+            count += response["Count"]
+            if "LastEvaluatedKey" not in response:
+                return count
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def top_up(self, size=TOKEN_POOL_SIZE):
+        """
+        Mint tokens until the pool holds at least size leasable tokens.
+        Returns the number of tokens added to the pool.
+
+        Parameters
+        ----------
+        size: int
+            Number of leasable tokens to keep in the pool
+        """
+
+        table = dynamodb().Table(self.table_name)
+
+        try:
+            missing = size - self.available()
+        except ClientError as e:
+            logger.error(f"Failed to count tokens in pool.\n{e}")
+            return 0
+
+        added = 0
+        for _ in range(missing):
+            # topping up is background work
+            minted = self.mint_token(BULK)
+            if minted is None:
+                break
+
+            token, expdate = minted
+            try:
+                table.put_item(
+                    Item={
+                        "pool": TOKEN_POOL_NAME,
+                        "token_id": create_token_id(expdate),
+                        "token": token,
+                        "expdate": expdate,
+                    }
+                )
+            except ClientError as e:
+                logger.error(f"Failed to add token to pool.\n{e}")
+                break
+            else:
+                added += 1
+
+        return added
+
+    def _leasable_condition(self):
+        min_token_id = f"{now() + self.min_validity:012d}"
+        return Key("pool").eq(TOKEN_POOL_NAME) & Key("token_id").gt(min_token_id)
+
+    def _lease_from_pool(self, deadline):
+        table = dynamodb().Table(self.table_name)
+
+        # tokens closest to expiry are leased first so fewer tokens go to waste
+        deadline.check()
+        try:
+            candidates = table.query(
+                KeyConditionExpression=self._leasable_condition(),
+                Limit=LEASE_CANDIDATES,
+            )["Items"]
+        except ClientError as e:
+            logger.error(f"Failed to query token pool.\n{e}")
+            return None
+
+        # spread concurrent invocations over the candidates to avoid conflicts
+        random.shuffle(candidates)
+
+        for candidate in candidates:
+            deadline.check()
+            try:
+                item = table.delete_item(
+                    Key={"pool": TOKEN_POOL_NAME, "token_id": candidate["token_id"]},
+                    ConditionExpression=Attr("token_id").exists(),
+                    ReturnValues="ALL_OLD",
+                )["Attributes"]
+            except ClientError as e:
+                code = e.response["Error"]["Code"]
+                if code != "ConditionalCheckFailedException":
+                    logger.error(f"Failed to lease token from pool.\n{e}")
+                    return None
+                continue
+            else:
+                return item["token"], int(item["expdate"])
+
+        return None
@@ -0,0 +1,134 @@
+import os
+import time
+import random
+import logging
+import requests
+
+from requests.adapters import HTTPAdapter
+
+# global variables
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 10))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", 1))
+BACKOFF_BASE_SECONDS = 0.1
+BACKOFF_MAX_SECONDS = 1.0
+DEFAULT_TIMEOUT = (3.05, 5)
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+MIN_RETRY_SECONDS = BACKOFF_MAX_SECONDS + 0.5
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def backoff(attempt):
+    """
+    Full jitter exponential backoff delay in seconds for a retry attempt
+
+    Parameters
+    ----------
+    attempt: int
+        Zero based number of the attempt that failed
+    """
+
+    return random.uniform(
+        0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt)
+    )
+
+
+class Transport:
+    """
+    HTTP transport shared across warm invocations. Connections are pooled and
+    kept alive so that only the first request to a host pays for the TCP and
+    TLS handshake. Idempotent requests are retried with jittered backoff,
+    other requests are only retried if the connection could not be opened.
+
+    Attributes
+    ----------
+    timeouts: dict
+        Tuple of connect and read timeout in seconds keyed by url
+    max_retries: int
+        Number of times a failed request is retried
+    requests_sent: int
+        Number of requests sent through the transport
+    """
+
+    def __init__(
+        self,
+        timeouts=None,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=HTTP_MAX_RETRIES,
+    ):
+        self.timeouts = timeouts or {}
+        self.max_retries = max_retries
+        self.requests_sent = 0
+
+        self._adapter = HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+    def post(self, url, idempotent=False, deadline=None, **kwargs):
+        """
+        Send a POST request and return the response. Raises
+        requests.RequestException if the request failed on every attempt.
+
+        Parameters
+        ----------
+        url: str
+            Request url
+        idempotent: bool
+            True if the request can safely be sent more than once
+        deadline: Deadline
+            Timeouts are capped at the time left and requests are not retried
+            once it is nearly up
+        kwargs: dict
+            Keyword arguments passed on to requests
+        """
+
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            timeout = self.timeouts.get(url, DEFAULT_TIMEOUT)
+            if deadline is not None:
+                timeout = deadline.cap(timeout)
+            self.requests_sent += 1
+
+            try:
+                res = self.session.post(url, timeout=timeout, **kwargs)
+            except requests.ConnectTimeout:
+                if last_attempt or self._out_of_time(deadline):
+                    raise
+            except requests.RequestException:
+                if last_attempt or not idempotent or self._out_of_time(deadline):
+                    raise
+            else:
+                if (
+                    last_attempt
+                    or not idempotent
+                    or res.status_code not in RETRY_STATUS_CODES
+                    or self._out_of_time(deadline)
+                ):
+                    return res
+
+            logger.info(f"Retrying request to {url}")
+            time.sleep(backoff(attempt))
+
+    def _out_of_time(self, deadline):
+        """Check if too little time is left to back off and retry"""
+
+        return deadline is not None and deadline.remaining() < MIN_RETRY_SECONDS
+
+    def connections_opened(self):
+        """Number of connections opened by the pools currently in use"""
+
+        pools = self._adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def stats(self):
+        """Counters that show how many requests reused a pooled connection"""
+
+        opened = self.connections_opened()
+        return {
+            "requests_sent": self.requests_sent,
+            "connections_opened": opened,
+            "connections_reused": max(self.requests_sent - opened, 0),
+        }
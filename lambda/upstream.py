@@ -0,0 +1,364 @@
+import os
+import re
+import json
+import time
+import random
+import string
+import logging
+import metrics
+import requests
+
+from datetime import datetime
+from circuit_breaker import FAILURE_CODES, CircuitBreaker
+from deadline import MIN_CALL_SECONDS, NO_DEADLINE, DeadlineExceeded
+from mobile_number import INVALID_NUMBER
+from rate_limiter import INTERACTIVE, RateLimiter
+from transport import Transport
+
+# create logger
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# global variables
+RANDOM_STR_LEN = 5
+API_BASE_URL = os.environ.get("API_BASE_URL", "https://api.aarogyasetu.gov.in")
+TOKEN_URL = f"{API_BASE_URL}/token"
+USER_STATUS_URL = f"{API_BASE_URL}/userstatus"
+USER_STATUS_BY_REQUEST_URL = f"{API_BASE_URL}/userstatusbyreqid"
+DATE_TIME_FORMAT = "%Y-%m-%d-%H:%M:%S"
+HTTP_TIMEOUTS = {
+    TOKEN_URL: (3.05, 3),
+    USER_STATUS_URL: (3.05, 4),
+    USER_STATUS_BY_REQUEST_URL: (3.05, 4),
+}
+RATE_LIMITS = {
+    TOKEN_URL: ("token", float(os.environ.get("TOKEN_RATE_PER_SECOND", 5))),
+    USER_STATUS_URL: (
+        "userstatus",
+        float(os.environ.get("USER_STATUS_RATE_PER_SECOND", 5)),
+    ),
+    USER_STATUS_BY_REQUEST_URL: (
+        "userstatusbyreqid",
+        float(os.environ.get("USER_STATUS_BY_REQUEST_RATE_PER_SECOND", 10)),
+    ),
+}
+AUTH_FAILURE_CODES = (401, 403)
+INVALID_NUMBER_CODES = (400, 404)
+# only errors that are about the phone number mark it invalid, not those of
+# a malformed request or token
+INVALID_NUMBER_EXPRESSION = re.compile(
+    r"invalid\s+(phone|mobile)|(phone|mobile)(\s+number)?\s+(is\s+)?"
+    r"(invalid|not\s+(registered|found))",
+    re.IGNORECASE,
+)
+MIN_UPSTREAM_CALL_SECONDS = float(os.environ.get("MIN_UPSTREAM_CALL_SECONDS", 1))
+# one connection for every number the status engine resolves at a time
+HTTP_POOL_SIZE = int(os.environ.get("STATUS_CONCURRENCY", 10))
+
+# http connections are kept alive across warm invocations
+transport = Transport(HTTP_TIMEOUTS, pool_maxsize=HTTP_POOL_SIZE)
+
+# upstream calls of every invocation share the same rate limits
+rate_limiter = RateLimiter(RATE_LIMITS, os.environ.get("UPSTREAM_STATE_TABLE"))
+
+# every endpoint is served by the same upstream so they share one breaker
+breaker = CircuitBreaker("aarogyasetu", os.environ.get("UPSTREAM_STATE_TABLE"))
+
+
+def create_request_header(secret, token=None):
+    """
+    Create header for API request to Aarogya Setu. There can be two types
+    of headers one with token and one without it.
+
+    Parameters
+    ----------
+    envvar: Secret
+        object contains api secrets
+    token: str
+        Request token given returned as reponse from TOKEN_URL
+    """
+
+    if token is None:
+        return {
+            "accept": "application/json",
+            "x-api-key": secret.API_KEY,
+            "Content-Type": "application/json",
+        }
+    else:
+        return {
+            "accept": "application/json",
+            "x-api-key": secret.API_KEY,
+            "Content-Type": "application/json",
+            "Authorization": token,
+        }
+
+
+def create_trace_id():
+    """
+    Create a unique trace_id by combining current timestamp and some random
+    ascii uppercase text.
+    """
+
+    timestamp = datetime.today().strftime(DATE_TIME_FORMAT)
+    randomstr = "".join(
+        random.choices(string.ascii_uppercase + string.digits, k=RANDOM_STR_LEN)
+    )
+    trace_id = timestamp + "-" + randomstr
+
+    return trace_id
+
+
+def check_auth_failure(res, credentials=None):
+    """
+    Invalidate cached credentials if Aarogya Setu rejected them, so that the
+    next request reloads the rotated secret from secrets manager
+
+    Parameters
+    ----------
+    res: requests.Response
+        Response returned by Aarogya Setu API
+    credentials: CredentialProvider
+        Provider the secret was taken from, nothing is invalidated if None
+    """
+
+    if credentials is not None and res.status_code in AUTH_FAILURE_CODES:
+        credentials.invalidate()
+
+
+def invalid_number_response(res):
+    """
+    Check if Aarogya Setu rejected a request because the phone number is
+    invalid or unknown. Only an error response whose message says so
+    counts, other client errors may be caused by the request or the token.
+
+    Parameters
+    ----------
+    res: requests.Response
+        Response returned by Aarogya Setu API
+    """
+
+    if res.status_code not in INVALID_NUMBER_CODES:
+        return False
+
+    try:
+        content = res.json()
+    except ValueError:
+        return False
+    if not isinstance(content, dict):
+        return False
+
+    message = " ".join(str(content.get(k, "")) for k in ("message", "error"))
+    return INVALID_NUMBER_EXPRESSION.search(message) is not None
+
+
+class RateLimitedError(requests.RequestException):
+    """Raised when a call to Aarogya Setu is over the rate limit"""
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised when calls to Aarogya Setu fail fast because it is down"""
+
+
+def post_upstream(
+    url, body, headers, priority=INTERACTIVE, idempotent=False, deadline=NO_DEADLINE
+):
+    """
+    Send a request to Aarogya Setu once the circuit breaker and the rate
+    limiter allow it. Raises requests.RequestException if the request is
+    rejected or fails.
+
+    Parameters
+    ----------
+    url: str
+        Aarogya Setu endpoint url
+    body: dict
+        Request body
+    headers: dict
+        Request headers
+    priority: str
+        INTERACTIVE for gate checks or BULK for background work
+    idempotent: bool
+        True if the request can safely be sent more than once
+    deadline: Deadline
+        Time budget of the invocation
+    """
+
+    # do not start a call that cannot finish in time
+    deadline.check(MIN_UPSTREAM_CALL_SECONDS)
+
+    # fail fast while Aarogya Setu is down instead of waiting for timeouts
+    if not breaker.allow(deadline):
+        raise CircuitOpenError(f"Circuit breaker for {url} is open")
+
+    # reading the shared breaker state takes some of the time left
+    deadline.check(MIN_UPSTREAM_CALL_SECONDS)
+    max_wait = deadline.remaining() - MIN_UPSTREAM_CALL_SECONDS
+    if not rate_limiter.acquire(url, priority, max_wait):
+        deadline.check(MIN_UPSTREAM_CALL_SECONDS)
+        raise RateLimitedError(f"Rate limit for {url} exceeded")
+
+    start = time.monotonic()
+    try:
+        res = transport.post(
+            url,
+            data=json.dumps(body),
+            headers=headers,
+            idempotent=idempotent,
+            deadline=deadline,
+        )
+    except requests.RequestException as e:
+        # a timeout cut short by the deadline says nothing about upstream
+        if deadline.remaining() < MIN_CALL_SECONDS:
+            raise DeadlineExceeded(f"Request to {url} ran out of time") from e
+        metrics.count("upstream_calls", "UpstreamStatus", "error")
+        breaker.record(False, deadline=deadline)
+        raise
+
+    metrics.count("upstream_calls", "UpstreamStatus", str(res.status_code))
+    success = res.status_code not in FAILURE_CODES
+    breaker.record(success, time.monotonic() - start, deadline)
+    rate_limiter.record(url, res.status_code, deadline)
+
+    return res
+
+
+def get_token(secret, priority=INTERACTIVE, deadline=NO_DEADLINE, credentials=None):
+    """
+    Get API token from Aarogya Setu it is valid for one hour and one succesful
+    status request
+
+    Parameters
+    ----------
+    envvar: Secret
+        Object contains secrets
+    priority: str
+        INTERACTIVE for gate checks or BULK for background work
+    deadline: Deadline
+        Time budget of the invocation
+    credentials: CredentialProvider
+        Provider the secret was taken from, invalidated if Aarogya Setu
+        rejects it
+    """
+
+    url = TOKEN_URL
+    headers = create_request_header(secret)
+    body = {"username": secret.USERNAME, "password": secret.PASSWORD}
+
+    try:
+        res = post_upstream(
+            url, body, headers, priority, idempotent=True, deadline=deadline
+        )
+    except requests.RequestException as e:
+        logger.error(f"Aarogya Setu API failed to get token.\n{e}")
+        return None
+
+    if res.status_code != requests.codes.ok:
+        logger.error(f"Aarogya Setu API failed to get token.\n{res.content}")
+        check_auth_failure(res, credentials)
+        return None
+    else:
+        return res.json()["token"]
+
+
+def create_new_request(
+    number, token, secret, priority=INTERACTIVE, deadline=NO_DEADLINE, credentials=None
+):
+    """
+    Create a new request with Aarogya Setu. Returns its request id, None if
+    the request failed or INVALID_NUMBER if Aarogya Setu rejected the number.
+
+    Parameters
+    ----------
+    number: str
+        User mobile number of the format "+91XXXXXXXXXX"
+    token: str
+        Request token given returned as reponse from TOKEN_URL
+    secret: Secret
+        Object contains secrets
+    priority: str
+        INTERACTIVE for gate checks or BULK for background work
+    deadline: Deadline
+        Time budget of the invocation
+    credentials: CredentialProvider
+        Provider the secret was taken from, invalidated if Aarogya Setu
+        rejects it
+    """
+
+    url = USER_STATUS_URL
+    trace_id = create_trace_id()
+
+    headers = create_request_header(secret, token)
+    body = {
+        "phone_number": number,
+        "trace_id": trace_id,
+        "reason": "Office entry",
+    }
+
+    # not idempotent, a retry would send the user a second consent request
+    try:
+        res = post_upstream(url, body, headers, priority, deadline=deadline)
+    except requests.RequestException as e:
+        logger.error(f"Aarogya Setu API failed to get request id.\n{e}")
+        return None
+
+    if res.status_code != requests.codes.ok:
+        logger.error(f"Aarogya Setu API failed to get request id.\n{res.content}")
+        check_auth_failure(res, credentials)
+        if invalid_number_response(res):
+            return INVALID_NUMBER
+        return None
+    else:
+        return res.json()["requestId"]
+
+
+def get_status_content(
+    number,
+    token,
+    request_id,
+    secret,
+    priority=INTERACTIVE,
+    deadline=NO_DEADLINE,
+    credentials=None,
+):
+    """
+    Get status for a pending request. Delete entry from pending request table
+    if successfully gets status
+
+    Parameters
+    ----------
+    number: str
+        User mobile number of the format "+91XXXXXXXXXX"
+    token: str
+        Request token given returned as reponse from TOKEN_URL
+    secret: Secret
+        Object contains secrets
+    priority: str
+        INTERACTIVE for gate checks or BULK for background work
+    deadline: Deadline
+        Time budget of the invocation
+    credentials: CredentialProvider
+        Provider the secret was taken from, invalidated if Aarogya Setu
+        rejects it
+    """
+
+    url = USER_STATUS_BY_REQUEST_URL
+    headers = create_request_header(secret, token)
+    body = {"requestId": request_id}
+
+    try:
+        res = post_upstream(
+            url, body, headers, priority, idempotent=True, deadline=deadline
+        )
+    except requests.RequestException as e:
+        logger.error(f"Aarogya Setu API failed to get status for given request.\n{e}")
+        return None
+
+    if res.status_code != requests.codes.ok:
+        logger.error(
+            f"Aarogya Setu API failed to get status for given request.\n{res.content}"
+        )
+        check_auth_failure(res, credentials)
+        return None
+    else:
+        return res.json()
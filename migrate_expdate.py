@@ -0,0 +1,346 @@
+"""
+Rewrite string expdate attributes as numbers so that DynamoDB TTL deletes
+expired items, and rewrite user status items stored in the long form in
+the compact form of lambda/item_codec.py so that they show up in the
+status index, which is keyed on the request status code.
+
+Tables are scanned in parallel segments and every item holding a string
+expdate or a long form status is updated in place with a conditional
+write, so items written by the handlers in the meantime are never
+overwritten. Progress is saved to a checkpoint file after every page and a
+stopped run carries on from there.
+
+    python migrate_expdate.py --table <UserStatusTable> --table <RequestsTable>
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+
+import boto3
+
+from boto3.dynamodb.conditions import Attr
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+# global variables
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lambda")
+LONG_FORM_ATTRIBUTES = ("request_status", "message", "colour")
+CHECKPOINT_PATH = "migrate_expdate.checkpoint.json"
+SEGMENTS = 8
+PAGE_SIZE = 500
+RETRY_CONFIG = Config(retries={"mode": "standard", "max_attempts": 10})
+
+
+class Checkpoint:
+    """
+    Progress of a migration saved to a json file. Each segment of a table
+    records the key its scan stopped at, whether it is done and its
+    counters.
+
+    Attributes
+    ----------
+    path: str
+        Path of the checkpoint file
+    tables: dict
+        Number of segments and progress of every segment keyed by table
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tables = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path) as f:
+                self.tables = json.load(f)
+
+    def segments(self, table_name, segments):
+        """
+        Get the number of segments of a table. A table that was started
+        before keeps the number of segments of its first run, as the
+        positions of its segments only make sense for that number.
+
+        Parameters
+        ----------
+        table_name: str
+            Table name
+        segments: int
+            Number of segments to use for a table that was not started yet
+        """
+
+        with self._lock:
+            table = self.tables.setdefault(
+                table_name, {"segments": segments, "positions": {}}
+            )
+            return table["segments"]
+
+    def position(self, table_name, segment):
+        """
+        Get the progress of a segment
+
+        Parameters
+        ----------
+        table_name: str
+            Table name
+        segment: int
+            Segment number
+        """
+
+        with self._lock:
+            positions = self.tables[table_name]["positions"]
+            default = {"key": None, "done": False, "scanned": 0, "converted": 0}
+            return dict(positions.get(str(segment), default))
+
+    def save(self, table_name, segment, position):
+        """
+        Record the progress of a segment and write the checkpoint file
+
+        Parameters
+        ----------
+        table_name: str
+            Table name
+        segment: int
+            Segment number
+        position: dict
+            Progress of the segment
+        """
+
+        with self._lock:
+            self.tables[table_name]["positions"][str(segment)] = position
+
+            # write to a temporary file so a crash never leaves a broken file
+            partial_path = self.path + ".partial"
+            with open(partial_path, "w") as f:
+                # number keys of the last evaluated key are read as Decimal
+                json.dump(self.tables, f, indent=2, default=int)
+            os.replace(partial_path, self.path)
+
+
+def numeric_expdate(expdate):
+    """
+    Convert a string expdate to an integer timestamp. Returns None if it is
+    not a number.
+
+    Parameters
+    ----------
+    expdate: str
+        Expiry date timestamp
+    """
+
+    try:
+        return int(expdate)
+    except ValueError:
+        return None
+
+
+def convert_item(table, key_names, item, dry_run=False):
+    """
+    Rewrite a string expdate as a number and a long form user status in the
+    compact form. Returns "encoded" for a rewritten user status, otherwise
+    "converted", or "changed" if the item was updated since it was read, or
+    "invalid" if its expdate is not a number.
+
+    Parameters
+    ----------
+    table: Table
+        DynamoDB table resource
+    key_names: list
+        Names of the key attributes of the table
+    item: dict
+        Item holding the key attributes, the expdate and any long form
+        status attributes
+    dry_run: bool
+        Count the items that would be converted without writing them
+    """
+
+    from item_codec import encode_user_status
+
+    expdate = item["expdate"]
+    if isinstance(expdate, str):
+        expdate = numeric_expdate(expdate)
+        if expdate is None:
+            return "invalid"
+
+    names = {"#expdate": "expdate"}
+    values = {":number": expdate, ":old": item["expdate"]}
+    updates = ["#expdate = :number"]
+    removes = []
+    condition = "#expdate = :old"
+    outcome = "converted"
+
+    # long form status items are the only ones with a colour attribute
+    if "colour" in item:
+        stored = encode_user_status({**item, "expdate": expdate})
+        for i, name in enumerate(sorted(set(stored) - {"mobile_number", "expdate"})):
+            names[f"#s{i}"] = name
+            values[f":s{i}"] = stored[name]
+            updates.append(f"#s{i} = :s{i}")
+        for i, name in enumerate(LONG_FORM_ATTRIBUTES):
+            if name not in stored:
+                names[f"#l{i}"] = name
+                removes.append(f"#l{i}")
+        names["#colour"] = "colour"
+        condition += " AND attribute_exists(#colour)"
+        outcome = "encoded"
+
+    if dry_run:
+        return outcome
+
+    expression = "SET " + ", ".join(updates)
+    if removes:
+        expression += " REMOVE " + ", ".join(removes)
+
+    try:
+        table.update_item(
+            Key={name: item[name] for name in key_names},
+            UpdateExpression=expression,
+            ConditionExpression=condition,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return "changed"
+        raise
+
+    return outcome
+
+
+def migrate_segment(args, checkpoint, table_name, key_names, segment, segments):
+    """
+    Scan one segment of a table for string expdates and long form user
+    statuses and convert them, starting from the position saved in the
+    checkpoint
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        Command line arguments
+    checkpoint: Checkpoint
+        Progress of the migration
+    table_name: str
+        Table name
+    key_names: list
+        Names of the key attributes of the table
+    segment: int
+        Segment scanned by this call
+    segments: int
+        Number of segments the table is split into
+    """
+
+    position = checkpoint.position(table_name, segment)
+    if position["done"]:
+        return position
+
+    # boto3 resources are not thread safe, every segment gets its own
+    session = boto3.session.Session()
+    table = session.resource(
+        "dynamodb", endpoint_url=args.endpoint_url, config=RETRY_CONFIG
+    ).Table(table_name)
+
+    names = {f"#k{i}": name for i, name in enumerate(key_names)}
+    names["#expdate"] = "expdate"
+    for i, name in enumerate(LONG_FORM_ATTRIBUTES):
+        names[f"#l{i}"] = name
+    kwargs = {
+        "Segment": segment,
+        "TotalSegments": segments,
+        "Limit": args.page_size,
+        "FilterExpression": Attr("expdate").attribute_type("S")
+        | Attr("colour").exists(),
+        "ProjectionExpression": ", ".join(names),
+        "ExpressionAttributeNames": names,
+    }
+
+    while True:
+        if position["key"]:
+            kwargs["ExclusiveStartKey"] = position["key"]
+
+        page = table.scan(**kwargs)
+        position["scanned"] += page["ScannedCount"]
+
+        for item in page["Items"]:
+            outcome = convert_item(table, key_names, item, args.dry_run)
+            position[outcome] = position.get(outcome, 0) + 1
+
+        position["key"] = page.get("LastEvaluatedKey")
+        position["done"] = position["key"] is None
+
+        # a dry run must not mark anything as done
+        if not args.dry_run:
+            checkpoint.save(table_name, segment, position)
+
+        if position["done"]:
+            return position
+
+
+def migrate(args):
+    """
+    Convert every table given on the command line. Returns the progress of
+    every segment keyed by table.
+
+    Parameters
+    ----------
+    args: argparse.Namespace
+        Command line arguments
+    """
+
+    # user statuses are encoded with the codec of the handlers
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+
+    checkpoint = Checkpoint(args.checkpoint)
+    resource = boto3.resource("dynamodb", endpoint_url=args.endpoint_url)
+
+    jobs = []
+    for table_name in args.table:
+        key_names = [
+            key["AttributeName"] for key in resource.Table(table_name).key_schema
+        ]
+        segments = checkpoint.segments(table_name, args.segments)
+        for segment in range(segments):
+            jobs.append((table_name, key_names, segment, segments))
+
+    with ThreadPoolExecutor(max_workers=args.workers or len(jobs)) as executor:
+        futures = [
+            (job[0], executor.submit(migrate_segment, args, checkpoint, *job))
+            for job in jobs
+        ]
+        results = {}
+        for table_name, future in futures:
+            results.setdefault(table_name, []).append(future.result())
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--table", action="append", required=True)
+    parser.add_argument("--segments", type=int, default=SEGMENTS)
+    parser.add_argument("--workers", type=int, help="defaults to one per segment")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--endpoint-url", help="for DynamoDB Local or moto")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    results = migrate(args)
+
+    incomplete = False
+    for table_name, positions in results.items():
+        totals = {}
+        for position in positions:
+            for name in ("scanned", "converted", "encoded", "changed", "invalid"):
+                totals[name] = totals.get(name, 0) + position.get(name, 0)
+            incomplete = incomplete or not position["done"]
+        print(f"{table_name}: {totals}")
+
+    return int(incomplete)
+
+
+if __name__ == "__main__":
+    sys.exit(main())